@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+# Metrics where a smaller number is better; everything else is a throughput.
+LOWER_IS_BETTER = ("_ms", "_mb", "_s")
+
+
+def make_granules(out, count, size, seed=0):
+    # INSAT-3D L1C-like layout: TIR1 grey counts + lookup table, WV counts,
+    # scaled integer Latitude/Longitude grids and a time axis of length one.
+    import h5py
+
+    rng = np.random.default_rng(seed)
+    lut = np.linspace(180, 320, 1024).astype("f4")
+    yy, xx = np.mgrid[0:size, 0:size]
+    lat = (np.linspace(5, 35, size)[:, None] * np.ones((1, size)) * 100).astype("i2")
+    lon = (np.ones((size, 1)) * np.linspace(68, 98, size)[None] * 100).astype("i4")
+    names = []
+    for i in range(count):
+        bt = np.full((size, size), 290.0) + rng.normal(0, 5, (size, size))
+        for _ in range(6):
+            cy, cx, r = rng.integers(0, size, 2).tolist() + [int(rng.integers(size // 40 + 2, size // 8 + 3))]
+            bt[(yy - cy) ** 2 + (xx - cx) ** 2 < r * r] = rng.uniform(195, 230)
+        name = f"3DIMG_{24 + i // 48:02d}MAY2024_{(i % 48) // 2:02d}{(i % 2) * 30:02d}_L1C_ASIA_MER.h5"
+        with h5py.File(os.path.join(out, name), "w") as f:
+            f.create_dataset(
+                "IMG_TIR1",
+                data=np.searchsorted(lut, bt).astype("u2")[None],
+                chunks=(1, min(size, 256), size),
+                compression="gzip",
+            )
+            f["IMG_TIR1_TEMP"] = lut
+            f.create_dataset("IMG_WV", data=rng.integers(0, 1024, (1, size, size), dtype="u2"), compression="gzip")
+            f["IMG_WV_TEMP"] = np.linspace(180, 260, 1024).astype("f4")
+            f.create_dataset("Latitude", data=lat).attrs["scale_factor"] = np.float32(0.01)
+            f.create_dataset("Longitude", data=lon).attrs["scale_factor"] = np.float32(0.01)
+        names.append(name)
+    return names
+
+
+def timed(fn, reps=1):
+    out, ts = None, []
+    for _ in range(reps):
+        t = time.perf_counter()
+        out = fn()
+        ts.append(time.perf_counter() - t)
+    return out, np.array(ts)
+
+
+def pct(ts):
+    return {"p50_ms": float(np.percentile(ts, 50) * 1e3), "p99_ms": float(np.percentile(ts, 99) * 1e3)}
+
+
+def bench_ingest(tmp, files, size):
+    import scanner
+
+    data_dir = os.path.join(tmp, "data")
+    os.makedirs(data_dir)
+    _, t_gen = timed(lambda: make_granules(data_dir, files, size))
+    names = sorted(os.listdir(data_dir))
+    scanner.DATA_DIR = data_dir
+
+    _, t_coords = timed(lambda: [scanner.get_coords(os.path.join(data_dir, n)) for n in names])
+    scanner._cache.clear()
+    info, t_scan = timed(lambda: scanner.load_files(names))
+    regions = sum(len(r["regions"]) for r in info.values())
+    return {
+        "generate_s": float(t_gen[0]),
+        "get_coords_files_per_sec": files / t_coords[0],
+        "scan_files_per_sec": files / t_scan[0],
+        "regions_per_file": regions / files,
+    }
+
+
+def bench_db(tmp, rows, reps):
+    import data
+    import db
+
+    path = os.path.join(tmp, "bench.db")
+    cn = db.connect(path)
+    db.init_db(cn)
+    rng = np.random.default_rng(1)
+    types = np.array(db.EVENTS)
+    recs = list(
+        zip(
+            ["bench.h5"] * rows,
+            rng.uniform(6, 37, rows).tolist(),
+            rng.uniform(68, 98, rows).tolist(),
+            rng.uniform(50, 150, rows).tolist(),
+            types[rng.integers(0, len(types), rows)].tolist(),
+            ["2024-05-24 00:00:00"] * rows,
+            rng.uniform(190, 300, rows).tolist(),
+            [None] * rows,
+            [None] * rows,
+        )
+    )
+
+    def write():
+        with db.transaction(cn):
+            db.insert_rows(cn, recs)
+            db.bump_version(cn)
+
+    _, t_ins = timed(write)
+    cn.close()
+
+    _, t_all = timed(lambda: data.load_events(path=path), max(1, reps // 5))
+    _, t_evt = timed(lambda: data.load_events("cyclone", path=path), reps)
+    _, t_box = timed(lambda: data.query_bbox(18, 22, 80, 84, path=path), reps)
+    _, t_rad = timed(lambda: data.query_radius(20, 82, 100, path=path), reps)
+    _, t_ver = timed(lambda: data.version(path), reps)
+    return {
+        "insert_rows_per_sec": rows / t_ins[0],
+        "load_all": pct(t_all),
+        "load_event": pct(t_evt),
+        "bbox": pct(t_box),
+        "radius": pct(t_rad),
+        "version": pct(t_ver),
+    }
+
+
+def bench_inference(tmp, points):
+    try:
+        import torch
+
+        from inference import CyclonePredictor, WeatherAI
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    path = os.path.join(tmp, "model.pth")
+    torch.save(CyclonePredictor().state_dict(), path)
+    ai = WeatherAI(path)
+    x = np.random.default_rng(2).random((points, 5)).astype("f4") * [30, 30, 120, 800, 60] + [6, 68, 190, 0, 0]
+
+    single = min(points, 2000)
+    _, t_one = timed(lambda: [ai.predict(*map(float, r)) for r in x[:single]])
+    _, t_batch = timed(lambda: ai.predict_batch(x), 3)
+    return {
+        "predict_per_sec": single / t_one[0],
+        "predict_batch_per_sec": points / float(np.median(t_batch)),
+    }
+
+
+def bench_forecast(zones, steps, reps):
+    import pandas as pd
+
+    import forecast
+
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame(
+        {
+            "lat": rng.uniform(6, 37, zones),
+            "lon": rng.uniform(68, 98, zones),
+            "intensity": rng.uniform(50, 150, zones),
+            "event_type": "cyclone",
+        }
+    )
+    _, ts = timed(lambda: forecast.predict(df, steps=steps), reps)
+    return {**pct(ts), "zone_steps_per_sec": zones * steps / float(np.median(ts))}
+
+
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, kids) / 1024.0
+
+
+def flatten(d, pre=""):
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{pre}{k}."))
+        elif isinstance(v, (int, float)):
+            out[f"{pre}{k}"] = float(v)
+    return out
+
+
+def compare(res, base, tol):
+    cur, old = flatten(res["results"]), flatten(base["results"])
+    worse = []
+    for k in sorted(cur.keys() & old.keys()):
+        if not old[k]:
+            continue
+        ratio = cur[k] / old[k]
+        lower = k.endswith(LOWER_IS_BETTER)
+        bad = ratio > 1 + tol if lower else ratio < 1 - tol
+        print(f"{'REGRESSION' if bad else 'ok':>10}  {k:<40} {old[k]:>14.3f} -> {cur[k]:>14.3f} ({ratio:.2f}x)")
+        if bad:
+            worse.append(k)
+    return worse
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ambaram Sentinel hot-path benchmarks")
+    ap.add_argument("--files", type=int, default=8, help="synthetic granules to generate")
+    ap.add_argument("--size", type=int, default=512, help="granule edge length in pixels")
+    ap.add_argument("--rows", type=int, default=200000, help="rows for the DB stages")
+    ap.add_argument("--points", type=int, default=100000, help="points for batch inference")
+    ap.add_argument("--zones", type=int, default=5000)
+    ap.add_argument("--steps", type=int, default=24)
+    ap.add_argument("--reps", type=int, default=50)
+    ap.add_argument("--only", nargs="*", choices=["ingest", "db", "inference", "forecast"])
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline", help="compare against this results file")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    a = ap.parse_args()
+    if a.baseline and os.path.abspath(a.baseline) == os.path.abspath(a.out):
+        ap.error("--out would overwrite --baseline; write the new run to another file")
+    base = None
+    if a.baseline:
+        with open(a.baseline) as fp:
+            base = json.load(fp)
+
+    stages = a.only or ["ingest", "db", "inference", "forecast"]
+    res = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(a),
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for s in stages:
+            print(f"[{s}]", flush=True)
+            if s == "ingest":
+                r = bench_ingest(tmp, a.files, a.size)
+            elif s == "db":
+                r = bench_db(tmp, a.rows, a.reps)
+            elif s == "inference":
+                r = bench_inference(tmp, a.points)
+            else:
+                r = bench_forecast(a.zones, a.steps, a.reps)
+            res["results"][s] = r
+            print(json.dumps(r, indent=2))
+    res["results"]["peak_rss_mb"] = peak_rss_mb()
+
+    with open(a.out, "w") as fp:
+        json.dump(res, fp, indent=2)
+    print(f"Results written to {a.out}")
+
+    if base:
+        worse = compare(res, base, a.tolerance)
+        if worse:
+            print(f"{len(worse)} metrics regressed more than {a.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
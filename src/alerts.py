@@ -0,0 +1,171 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import db
+import metrics
+import regions
+from events import meta
+
+BATCH = 50000
+DEDUP_KM = 50.0
+DEDUP_HOURS = 6
+
+# Per-event thresholds in real units (intensity / meta divisor), most severe
+# first. ">=" rules fire above the value, "<=" rules below it.
+rules = {
+    "cyclone": [("SEVERE", ">=", 118), ("HIGH", ">=", 89), ("MODERATE", ">=", 62)],
+    "heatwave": [("SEVERE", ">=", 47), ("HIGH", ">=", 45), ("MODERATE", ">=", 40)],
+    "coldwave": [("SEVERE", "<=", 2), ("HIGH", "<=", 4), ("MODERATE", "<=", 10)],
+    "sandstorm": [("SEVERE", ">=", 120), ("HIGH", ">=", 90), ("MODERATE", ">=", 60)],
+    "rainfall": [("SEVERE", ">=", 204.5), ("HIGH", ">=", 115.6), ("MODERATE", ">=", 64.5)],
+    "cloudburst": [("SEVERE", ">=", 150), ("HIGH", ">=", 100)],
+    "monsoon": [("SEVERE", ">=", 204.5), ("HIGH", ">=", 115.6), ("MODERATE", ">=", 64.5)],
+}
+
+SEVERITY_RANK = {"SEVERE": 3, "HIGH": 2, "MODERATE": 1}
+
+
+def classify(typ, val):
+    # Returns the severity of every value in `val`, "" where no rule fires.
+    out = np.full(len(val), "", dtype=object)
+    for sev, op, lim in reversed(rules.get(typ, [])):
+        hit = val >= lim if op == ">=" else val <= lim
+        out[hit] = sev
+    return out
+
+
+def _parse(ts):
+    try:
+        return datetime.fromisoformat(str(ts))
+    except ValueError:
+        return datetime.utcnow()
+
+
+class Deduper:
+    # Grid of DEDUP_KM cells holding the alerts already issued; a candidate is
+    # a duplicate if an alert of the same type sits within DEDUP_KM and
+    # DEDUP_HOURS of it.
+    def __init__(self, km=DEDUP_KM, hours=DEDUP_HOURS):
+        self.km = km
+        self.win = timedelta(hours=hours)
+        self.cell = km / 111.32
+        self.grid = {}
+
+    def _key(self, typ, lat, lon):
+        return typ, int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell))
+
+    def add(self, typ, lat, lon, ts):
+        self.grid.setdefault(self._key(typ, lat, lon), []).append((lat, lon, ts))
+
+    def seen(self, typ, lat, lon, ts):
+        _, cy, cx = self._key(typ, lat, lon)
+        for dy in (-1, 0, 1):
+            for dx in (-2, -1, 0, 1, 2):
+                for la, lo, t in self.grid.get((typ, cy + dy, cx + dx), ()):
+                    if abs(t - ts) <= self.win and _km(lat, lon, la, lo) <= self.km:
+                        return True
+        return False
+
+
+def _km(la1, lo1, la2, lo2):
+    p1, p2 = math.radians(la1), math.radians(la2)
+    a = (
+        math.sin((p2 - p1) / 2) ** 2
+        + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lo2 - lo1) / 2) ** 2
+    )
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+@metrics.timed("alert_eval_seconds")
+def evaluate(cn, batch=BATCH):
+    hwm = db.get_meta(cn, "alert_hwm")
+    total = 0
+
+    while True:
+        rows = cn.execute(
+            "SELECT id, lat, lon, intensity, event_type, obs_time, region FROM weather_data "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (hwm, batch),
+        ).fetchall()
+        if not rows:
+            break
+
+        cols = list(zip(*rows))
+        ids = np.array(cols[0], dtype=np.int64)
+        lat = np.array(cols[1], dtype=np.float64)
+        lon = np.array(cols[2], dtype=np.float64)
+        val = np.array(cols[3], dtype=np.float64)
+        typ = np.array(cols[4], dtype=object)
+        ts = cols[5]
+        reg = np.array(cols[6], dtype=object)
+        miss = np.flatnonzero([r is None for r in reg])  # not yet tagged by regions.update
+        if len(miss):
+            reg[miss] = regions.lookup(lat[miss], lon[miss])
+
+        cand = []
+        for t in np.unique(typ):
+            m = np.flatnonzero(typ == t)
+            div = meta.get(t, ["", "", 1])[2]
+            real = val[m] / div
+            sev = classify(t, real)
+            for i in np.flatnonzero(sev != ""):
+                j = m[i]
+                cand.append((SEVERITY_RANK[sev[i]], real[i], j, t, sev[i]))
+
+        new = []
+        if cand:
+            dd = _recent(cn, ts)
+            # Strongest candidates claim an area first.
+            cand.sort(key=lambda c: (-c[0], -c[1]))
+            for _, real, j, t, sev in cand:
+                when = _parse(ts[j]) if ts[j] else datetime.utcnow()
+                if dd.seen(t, lat[j], lon[j], when):
+                    continue
+                dd.add(t, lat[j], lon[j], when)
+                new.append(
+                    (when.strftime("%Y-%m-%d %H:%M:%S"), lat[j], lon[j], reg[j], t, sev, real, False)
+                )
+
+        hwm = int(ids[-1])
+        with db.transaction(cn):
+            cn.executemany(
+                "INSERT INTO weatheralert (timestamp, latitude, longitude, region_name, event_type, severity, value, is_notified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                new,
+            )
+            db.set_meta(cn, "alert_hwm", hwm)
+            if new:
+                db.bump_version(cn)
+        total += len(new)
+
+        if len(rows) < batch:
+            break
+
+    return total
+
+
+def _recent(cn, ts):
+    dd = Deduper()
+    known = [_parse(t) for t in ts if t]
+    start = min(known) if known else datetime.utcnow()
+    since = (start - dd.win).strftime("%Y-%m-%d %H:%M:%S")
+    for t, la, lo, when in cn.execute(
+        "SELECT event_type, latitude, longitude, timestamp FROM weatheralert WHERE timestamp >= ?",
+        (since,),
+    ):
+        dd.add(t, la, lo, _parse(when))
+    return dd
+
+
+def run():
+    cn = db.connect()
+    db.init_db(cn)
+    n = evaluate(cn)
+    print(f"{n} new alerts written to {db.display()}")
+    cn.close()
+
+
+if __name__ == "__main__":
+    run()
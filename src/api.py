@@ -0,0 +1,174 @@
+import hashlib
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import data
+import export
+import forecast
+import metrics
+
+MAX_LIMIT = 10000
+
+app = FastAPI(title="Ambaram Sentinel API")
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST"])
+
+class Points(BaseModel):
+    # Rows of (lat, lon, bt, insolation, moisture).
+    points: List[List[float]]
+
+
+def parse_bbox(bbox):
+    if not bbox:
+        return None
+    try:
+        v = [float(x) for x in bbox.split(",")]
+    except ValueError:
+        v = []
+    if len(v) != 4:
+        raise HTTPException(400, "bbox must be lat0,lat1,lon0,lon1")
+    return v
+
+
+async def cached(request, response, fn):
+    # ETag = data version + query, so clients revalidate for free until the
+    # scanner commits new rows.
+    ver = await run_in_threadpool(data.version)
+    tag = hashlib.sha1(f"{ver}|{request.url.path}?{request.url.query}".encode()).hexdigest()[:20]
+    etag = f'W/"{tag}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    body = await run_in_threadpool(fn)
+    body["version"] = ver
+    return body
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "version": await run_in_threadpool(data.version)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.exposition(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/types")
+async def types(request: Request, response: Response):
+    return await cached(request, response, lambda: {"items": data.event_types()})
+
+
+@app.get("/events")
+async def events(
+    request: Request,
+    response: Response,
+    type: Optional[str] = None,
+    bbox: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    after_id: int = 0,
+    limit: int = Query(1000, ge=1, le=MAX_LIMIT),
+):
+    box = parse_bbox(bbox)
+
+    def fn():
+        items = data.page_events(type, box, since, until, after_id, limit)
+        nxt = items[-1]["id"] if len(items) == limit else None
+        return {"items": items, "next_after": nxt}
+
+    return await cached(request, response, fn)
+
+
+@app.get("/alerts")
+async def alerts(
+    request: Request,
+    response: Response,
+    type: Optional[str] = None,
+    pending: Optional[bool] = None,
+    after_id: int = 0,
+    limit: int = Query(1000, ge=1, le=MAX_LIMIT),
+):
+    def fn():
+        items = data.page_alerts(type, pending, after_id, limit)
+        nxt = items[-1]["id"] if len(items) == limit else None
+        return {"items": items, "next_after": nxt}
+
+    return await cached(request, response, fn)
+
+
+@app.get("/forecast")
+async def get_forecast(
+    request: Request,
+    response: Response,
+    type: str,
+    steps: int = Query(forecast.STEPS, ge=1, le=forecast.STEPS),
+):
+    # Only the horizon the ingest pipeline stores; nothing is predicted here.
+    def fn():
+        fut = data.load_forecast(type, steps)
+        return {"items": fut.to_dict(orient="records")}
+
+    return await cached(request, response, fn)
+
+
+@app.post("/predict")
+async def predict(body: Points):
+    x = np.asarray(body.points, dtype=np.float32)
+    if x.ndim != 2 or x.shape[1] != 5:
+        raise HTTPException(400, "points must be rows of (lat, lon, bt, insolation, moisture)")
+
+    def fn():
+        # Shares the ingest pipeline's loader, which retries a failed load
+        # once the weights file changes.
+        ai = forecast.default_ai()
+        return ai.predict_batch(x) if ai else None
+
+    out = await run_in_threadpool(fn)
+    if out is None:
+        raise HTTPException(503, "model not loaded")
+    return {k: np.asarray(v).tolist() for k, v in out.items()}
+
+
+def download(path, name):
+    # Read CHUNK by CHUNK, so a multi-GB archive never sits in memory.
+    # The files are already compressed; identity keeps GZipMiddleware off them.
+    name = re.sub(r"[^\w.-]", "_", name)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{name}"',
+        "Content-Length": str(os.path.getsize(path)),
+        "Content-Encoding": "identity",
+    }
+    return StreamingResponse(export.stream(path), media_type="application/octet-stream", headers=headers)
+
+
+@app.get("/exports/{key}.zip")
+async def get_export(key: str, name: str = "export.zip"):
+    path = export.locate(key)
+    if path is None:
+        raise HTTPException(404, "archive not ready")
+    return download(path, name)
+
+
+@app.get("/files/{name}")
+async def get_file(name: str):
+    path = export.raw_file(name)
+    if path is None:
+        raise HTTPException(404, "no such granule")
+    return download(path, name)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -1,19 +1,27 @@
 import datetime
-import io
 import os
-import sqlite3
 import time
-import zipfile
+from urllib.parse import quote
+from urllib.request import urlopen
 
-import numpy as np
 import pandas as pd
 import pydeck as pdk
 import streamlit as st
-import torch
+
+import data
+import export
+import forecast
+import heatmap
+import metrics
+import registry
+from events import event_order, meta
 
 st.set_page_config(page_title="Ambaram Sentinel", layout="wide", page_icon="🛰️")
 
-DB_FILE = "weather.db"
+# Raw files and archives are downloaded from the API (uvicorn api:app),
+# which streams them from disk. Without it single files fall back to an
+# in-memory download and archives are unavailable.
+API_URL = os.environ.get("AMBARAM_API_URL", "http://localhost:8000")
 
 HTML_COMBINED = """
 <a href='https://en.wikipedia.org/wiki/INSAT-3D' target='_blank' class='billboard-link'>
@@ -41,76 +49,85 @@ HTML_COMBINED = """
 HTML_DISCLAIMER = """<div style="text-align: center; color: #666; font-size: 0.8em; margin-top: 15px;">Restricted Access: Displayed telemetry reflects archived satellite data packet from May 24, 2024 to May 28, 2024.<br>Further development on selected date prediction on events are in development phase will be available in future versions.</div>"""
 HTML_FOOTER = """<div class="footer"><p>Minor Project AMBARAM [Group: 203 (D)] © 2025-2026 &nbsp;|&nbsp; <a href="https://www.mosdac.gov.in/" target="_blank">MOSDAC Data</a> &nbsp;|&nbsp; <a href="#" target="_blank">Project Documentation</a> &nbsp;|&nbsp; <a href="#" target="_blank">Main Website</a></p></div>"""
 
-event_order = [
-    "cyclone",
-    "heatwave",
-    "coldwave",
-    "sandstorm",
-    "rainfall",
-    "cloudburst",
-    "monsoon",
-]
-
-meta = {
-    "cyclone": ["🚨", "WIND (KM/H)", 1],
-    "heatwave": ["🔥", "TEMP (°C)", 2.8],
-    "coldwave": ["❄️", "TEMP (°C)", 2.8],
-    "sandstorm": ["🌪️", "WIND (KM/H)", 1],
-    "rainfall": ["🌧️", "RAIN (MM)", 1],
-    "cloudburst": ["⚡", "RATE (MM/HR)", 0.8],
-    "monsoon": ["⛈️", "RAIN (MM)", 1],
-}
+@st.cache_data(max_entries=4)
+def probe_model(mtime):
+    # `mtime` only keys the cache: the weights are re-checked when train.py
+    # publishes a new file. The load runs in a child process so torch stays
+    # out of the Streamlit server.
+    return registry.probe(registry.MODEL_PATH)
+
+
+def model_status():
+    model_filename = os.path.basename(registry.MODEL_PATH)
+    if not os.path.exists(os.path.dirname(registry.MODEL_PATH)):
+        return False, "Models Folder Missing"
+    if not os.path.exists(registry.MODEL_PATH):
+        return False, "No Model Found"
+    if not probe_model(os.path.getmtime(registry.MODEL_PATH)):
+        return False, "File Corrupted"
+    return True, model_filename
 
 
 @st.cache_resource
-def load_ai_model():
-    model_dir = os.path.join("models")
+def start_metrics():
+    # One exporter thread per server process, shared by every session.
+    return metrics.serve()
 
-    if not os.path.exists(model_dir):
-        return False, "Models Folder Missing"
 
-    files = [f for f in os.listdir(model_dir) if f.endswith(".pth")]
+@st.cache_resource(max_entries=32)
+def get_data(event_type, version):
+    # `version` only keys the cache; the scanner bumps it on every commit.
+    # cache_resource hands every session the same memory-mapped frame
+    # instead of a pickled copy, so callers must not modify it.
+    return data.load_columns(event_type)
 
-    if files:
-        model_filename = files[0]
-        model_full_path = os.path.join(model_dir, model_filename)
-        try:
-            torch.load(model_full_path, map_location=torch.device("cpu"))
-            return True, model_filename
-        except:
-            return False, "File Corrupted"
-    else:
-        return False, "No Model Found"
+
+@st.cache_data(max_entries=32)
+def get_view(event_type, version, bbox):
+    return data.query_bbox(*bbox, event_type=event_type)
+
+
+@st.cache_data(max_entries=32)
+def get_heat(event_type, version, div):
+    sub = get_data(event_type, version)
+    return heatmap.build_levels(sub["lat"], sub["lon"], sub["intensity"] / div)
+
+
+@st.cache_data(max_entries=32)
+def get_forecast(event_type, version):
+    # Filled by the ingest pipeline; nothing is predicted on a rerun.
+    return data.load_forecast(event_type)
 
 
-def get_data():
+@st.cache_data(max_entries=32)
+def get_regions(event_type, version):
+    return data.region_summary(event_type)
+
+
+@st.cache_data(max_entries=4)
+def get_types(version):
+    return data.event_types()
+
+
+@st.cache_data(ttl=30)
+def api_up():
     try:
-        con = sqlite3.connect(DB_FILE)
-        q = "SELECT lat, lon, intensity, event_type FROM weather_data ORDER BY id ASC"
-        df = pd.read_sql(q, con)
-        con.close()
-        return df
-    except:
-        return pd.DataFrame()
-
-
-def predict_with_intensity(df):
-    if len(df) < 1:
-        return []
-    active_zones = df.tail(10).copy()
-    res = []
-
-    for i, row in active_zones.iterrows():
-        curr = np.array([row["lat"], row["lon"]])
-        curr_int = row["intensity"]
-        move = np.array([0.2, -0.15])
-
-        for _ in range(3):
-            nxt = curr + move
-            curr_int = curr_int * 0.95
-            res.append([nxt[0], nxt[1], curr_int])
-            curr = nxt
-    return res
+        with urlopen(f"{API_URL}/health", timeout=1) as r:
+            return r.status == 200
+    except (OSError, ValueError):
+        return False
+
+
+def zip_link(data_path, files, label, name):
+    if not api_up():
+        st.info(f"ZIP downloads need the API at {API_URL} (uvicorn api:app).")
+        return
+    path, job = export.request(data_path, files)
+    if job is not None:
+        with st.spinner(f"Packing {len(files)} files..."):
+            job.result()
+    key = os.path.basename(path)[: -len(".zip")]
+    st.link_button(label, f"{API_URL}/exports/{key}.zip?name={quote(name)}")
 
 
 bg_url = "https://images.unsplash.com/photo-1451187580459-43490279c0fa?q=80&w=2072&auto=format&fit=crop"
@@ -181,7 +198,8 @@ a.billboard-link {{ text-decoration: none; color: inherit; display: block; }}
     unsafe_allow_html=True,
 )
 
-model_status, model_name = load_ai_model()
+ai_ok, model_name = model_status()
+start_metrics()
 
 with st.sidebar:
     st.image("https://cdn-icons-png.flaticon.com/512/1039/1039328.png", width=70)
@@ -191,7 +209,7 @@ with st.sidebar:
     st.markdown("**SYSTEM STATUS**")
     st.success("✅ Database: CONNECTED")
 
-    if model_status:
+    if ai_ok:
         st.success(f"✅ AI Model: ACTIVE\n({model_name})")
     else:
         st.warning("⚠️ AI Model: SIMULATION")
@@ -199,11 +217,11 @@ with st.sidebar:
     st.info(f"🕒 Time: {datetime.datetime.now().strftime('%H:%M UTC')}")
     st.markdown("---")
 
-    df = get_data()
+    ver = data.version()
+    types = get_types(ver)
 
-    if not df.empty:
+    if types:
         st.header("📍 SELECTION")
-        types = df["event_type"].unique()
         sorted_types = sorted(
             available_types := types,
             key=lambda x: event_order.index(x) if x in event_order else 99,
@@ -235,35 +253,30 @@ with st.sidebar:
 
                         if mode == "Single File":
                             sel_file = st.selectbox("Select File", h5_files)
-                            if sel_file:
-                                with open(
-                                    os.path.join(data_path, sel_file), "rb"
-                                ) as fp:
-                                    st.download_button(f"⬇️ {sel_file}", fp, sel_file)
+                            if sel_file and api_up():
+                                st.link_button(f"⬇️ {sel_file}", f"{API_URL}/files/{quote(sel_file)}")
+                            elif sel_file:
+                                with open(os.path.join(data_path, sel_file), "rb") as fp:
+                                    st.download_button(f"⬇️ {sel_file}", fp, file_name=sel_file)
                         elif mode == "Select Multiple":
                             sel_files = st.multiselect("Select Files", h5_files)
                             if sel_files:
-                                zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(zip_buffer, "w") as zf:
-                                    for f in sel_files:
-                                        zf.write(os.path.join(data_path, f), f)
-                                st.download_button(
+                                zip_link(
+                                    data_path,
+                                    sel_files,
                                     "⬇️ Download ZIP",
-                                    zip_buffer.getvalue(),
                                     "selected_data.zip",
-                                    "application/zip",
                                 )
                         elif mode == "Download All":
-                            if st.button("📦 Prepare All Files"):
-                                zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(zip_buffer, "w") as zf:
-                                    for f in h5_files:
-                                        zf.write(os.path.join(data_path, f), f)
-                                st.download_button(
+                            # Packing only starts on the click; a finished
+                            # archive is linked straight away.
+                            done = export.ready(data_path, h5_files)
+                            if done or st.button("📦 Prepare All Files"):
+                                zip_link(
+                                    data_path,
+                                    h5_files,
                                     "⬇️ Download Full Database",
-                                    zip_buffer.getvalue(),
                                     "full_data.zip",
-                                    "application/zip",
                                 )
                     else:
                         st.info("No raw H5 files found in repository.")
@@ -275,36 +288,39 @@ with st.sidebar:
         sel = None
         st.error("❌ NO DATA")
 
-if not df.empty and sel:
-    sub = df[df["event_type"] == sel].copy()
+if types and sel:
+    reg = get_regions(sel, ver)
     info = meta.get(sel, ["⚠️", "VAL", 1])
     icon, unit, div = info
     unit_only = unit.split("(")[1].replace(")", "")
 
-    sub["real_val"] = sub["intensity"] / div
+    view = pdk.ViewState(latitude=22.0, longitude=79.0, zoom=4, pitch=40)
+    vis = get_view(sel, ver, data.view_bbox(view.latitude, view.longitude, view.zoom))
+    vis["real_val"] = vis["intensity"] / div
 
     st.header(f"{icon} {sel.upper()} MONITORING CONSOLE")
 
     c1, c2, c3 = st.columns(3)
     c1.metric("EVENT STATUS", "ACTIVE", delta="LIVE FEED")
-    c2.metric("ZONES DETECTED", len(sub))
-    c3.metric(f"MAX {unit.split()[0]}", f"{sub['real_val'].max():.1f} {unit_only}")
+    c2.metric("ZONES DETECTED", int(reg["n"].sum()))
+    top = reg["max"].max() / div if len(reg) else float("nan")
+    c3.metric(f"MAX {unit.split()[0]}", f"{top:.1f} {unit_only}")
 
     lay = []
-    fut_data = predict_with_intensity(sub)
+    fut = get_forecast(sel, ver)
 
     if sel == "cyclone":
         l1 = pdk.Layer(
             "ScatterplotLayer",
-            data=sub,
+            data=vis,
             get_position="[lon, lat]",
             get_color=[255, 0, 0, 200],
             get_radius=25000,
             pickable=True,
         )
         lay.append(l1)
-        if fut_data:
-            fdf = pd.DataFrame(fut_data, columns=["lat", "lon", "intensity"])
+        if len(fut):
+            fdf = fut[["lat", "lon", "intensity"]]
             l2 = pdk.Layer(
                 "ScatterplotLayer",
                 data=fdf,
@@ -327,11 +343,12 @@ if not df.empty and sel:
                 "sandstorm": [255, 215, 0],
             }.get(sel, [138, 43, 226])
 
+        lvl = heatmap.pick_level(view.zoom)
         l1 = pdk.Layer(
             "HeatmapLayer",
-            data=sub,
+            data=get_heat(sel, ver, div)[lvl],
             get_position="[lon, lat]",
-            get_weight="real_val",
+            get_weight="weight",
             radius_pixels=60,
             intensity=2,
             threshold=0.3,
@@ -343,14 +360,15 @@ if not df.empty and sel:
         )
         lay.append(l1)
 
-        if fut_data:
-            fdf = pd.DataFrame(fut_data, columns=["lat", "lon", "intensity"])
-            fdf["real_val"] = fdf["intensity"] / div
+        if len(fut):
+            fdf = heatmap.bin_cells(
+                fut["lat"], fut["lon"], fut["intensity"] / div, heatmap.LEVELS[lvl]
+            )
             l2 = pdk.Layer(
                 "HeatmapLayer",
                 data=fdf,
                 get_position="[lon, lat]",
-                get_weight="real_val",
+                get_weight="weight",
                 radius_pixels=70,
                 intensity=1.5,
                 threshold=0.2,
@@ -362,7 +380,6 @@ if not df.empty and sel:
             )
             lay.append(l2)
 
-    view = pdk.ViewState(latitude=22.0, longitude=79.0, zoom=4, pitch=40)
     st.pydeck_chart(
         pdk.Deck(
             layers=lay,
@@ -372,15 +389,22 @@ if not df.empty and sel:
     )
 
     st.subheader(f"📊 LIVE REGIONAL DATA ({unit})")
-    d_show = sub[["lat", "lon", "real_val"]].tail(10).copy()
-    d_show.columns = ["LAT", "LON", unit]
+    d_show = pd.DataFrame(
+        {
+            "REGION": reg["region"],
+            "ZONES": reg["n"],
+            f"MAX {unit}": (reg["max"] / div).round(1),
+            f"MEAN {unit}": (reg["mean"] / div).round(1),
+        }
+    )
     d_show = d_show.reset_index(drop=True)
     d_show.index = d_show.index + 1
     st.dataframe(d_show, width=1200)
 
-    if fut_data:
-        st.subheader("🤖 AI PREDICTION FORECAST (NEXT 3 HRS)")
-        p_show = pd.DataFrame(fut_data, columns=["LAT", "LON", "INT_RAW"])
+    if len(fut):
+        st.subheader(f"🤖 AI PREDICTION FORECAST (NEXT {forecast.STEPS} HRS)")
+        p_show = fut[["lat", "lon", "intensity"]].copy()
+        p_show.columns = ["LAT", "LON", "INT_RAW"]
         p_show[unit] = (p_show["INT_RAW"] / div).round(2)
         p_show = p_show[["LAT", "LON", unit]].tail(10).reset_index(drop=True)
         p_show.index = p_show.index + 1
@@ -388,17 +412,38 @@ if not df.empty and sel:
 
     st.markdown("---")
     st.subheader("📡 SYSTEM DIAGNOSTICS & TELEMETRY")
+    rows = metrics.stages()
+    # Summed over the ingest jobs (scanner.py, watch.py), whichever ran.
+    dump = metrics.read()
+    files = sum(metrics.by_job("files_scanned", dump).values())
+    scan_s = sum(metrics.by_job("scan_run_seconds_sum", dump).values())
+    last = max(metrics.by_job("last_scan_timestamp", dump).values(), default=None)
+    queries = [r for r in rows if r["stage"].startswith("query_seconds")]
+
     c1, c2, c3, c4 = st.columns(4)
-    c1.progress(92, "Satellite Uplink")
-    c2.progress(34, "Server Load")
-    c3.progress(100, "Encryption")
-    c4.metric("Latency", "24ms", "-1.2ms")
+    c1.metric(
+        "Ingest",
+        f"{files / scan_s:.1f} files/s" if scan_s else "—",
+        f"last scan {datetime.datetime.fromtimestamp(last):%H:%M}" if last else None,
+        delta_color="off",
+    )
+    c2.metric("Rows Written", f"{int(sum(metrics.by_job('db_rows_written', dump).values())):,}")
+    c3.metric(
+        "Query Latency (p99)",
+        f"{max(r['p99_ms'] for r in queries):.1f}ms" if queries else "—",
+        f"p50 {min(r['p50_ms'] for r in queries):.1f}ms" if queries else None,
+        delta_color="off",
+    )
+    # Inference runs in the ingest jobs (forecast.refresh), not in this process.
+    c4.metric("Predictions", f"{int(sum(metrics.by_job('predictions', dump).values())):,}")
+    if rows:
+        st.dataframe(pd.DataFrame(rows).round(2), width=1200, hide_index=True)
 
     st.markdown(HTML_DISCLAIMER, unsafe_allow_html=True)
     st.markdown("---")
     st.markdown(HTML_COMBINED, unsafe_allow_html=True)
 
-elif df.empty:
+elif not types:
     st.markdown(
         "<h3 style='text-align: center; color: red;'>SYSTEM OFFLINE</h3>",
         unsafe_allow_html=True,
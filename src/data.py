@@ -0,0 +1,258 @@
+import math
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import db
+import metrics
+import regions
+import snapshot
+
+COLUMNS = ["id", "lat", "lon", "intensity", "event_type", "track_id"]
+EARTH_KM = 6371.0
+KM_PER_DEG = 111.32
+
+_local = threading.local()
+
+
+@contextmanager
+def reader(path=None):
+    # SQLite: one read connection per thread and database, reused across
+    # calls. Postgres: a pooled connection checked out for the call only, so
+    # idle API and Streamlit threads never pin one of the pool's slots.
+    if db.is_pg(path):
+        cn = db.connect(path, readonly=True)
+        try:
+            yield cn
+        finally:
+            cn.close()
+        return
+    pool = _local.__dict__.setdefault("pool", {})
+    cn = pool.get(path)
+    if cn is None:
+        cn = db.connect(path, readonly=True)
+        pool[path] = cn
+    yield cn
+
+
+def frame(cr, columns):
+    return pd.DataFrame(cr.fetchall(), columns=columns)
+
+
+def version(path=None):
+    try:
+        with reader(path) as cn:
+            return db.data_version(cn)
+    except (FileNotFoundError, *db.ERRORS):
+        return -1
+
+
+def event_types(path=None):
+    try:
+        with reader(path) as cn:
+            cr = cn.execute("SELECT DISTINCT event_type FROM weather_data")
+            return [r[0] for r in cr if r[0]]
+    except (FileNotFoundError, *db.ERRORS):
+        return []
+
+
+@metrics.timed("query_seconds", op="load_events")
+def load_events(event_type=None, since=None, until=None, columns=COLUMNS, path=None):
+    q = f"SELECT {', '.join(columns)} FROM weather_data"
+    cond, args = [], []
+    if event_type:
+        cond.append("event_type = ?")
+        args.append(event_type)
+    if since:
+        cond.append("obs_time >= ?")
+        args.append(str(since))
+    if until:
+        cond.append("obs_time < ?")
+        args.append(str(until))
+    if cond:
+        q += " WHERE " + " AND ".join(cond)
+    q += " ORDER BY id ASC"
+
+    try:
+        with reader(path) as cn:
+            return frame(cn.execute(q, args), columns)
+    except (FileNotFoundError, *db.ERRORS):
+        return pd.DataFrame(columns=columns)
+
+
+@metrics.timed("query_seconds", op="columns")
+def load_columns(event_type=None, path=None):
+    # Memory-mapped snapshot when it is as new as the database, else SQL.
+    try:
+        with reader(path) as cn:
+            ver = db.data_version(cn, "rows_version")
+    except (FileNotFoundError, *db.ERRORS):
+        ver = -1
+    df = snapshot.load(event_type, ver, snapshot.location(path))
+    if df is None:
+        metrics.inc("snapshot_misses")
+        df = load_events(event_type, path=path)
+    return df
+
+
+@metrics.timed("query_seconds", op="forecast")
+def load_forecast(event_type=None, steps=None, path=None):
+    cols = ["zone", "step", "lat", "lon", "intensity", "event_type", "model_version", "data_version"]
+    q = f"SELECT {', '.join(cols)} FROM forecast"
+    cond, args = [], []
+    if event_type:
+        cond.append("event_type = ?")
+        args.append(event_type)
+    if steps:
+        cond.append("step <= ?")
+        args.append(steps)
+    if cond:
+        q += " WHERE " + " AND ".join(cond)
+    q += " ORDER BY zone, step"
+
+    try:
+        with reader(path) as cn:
+            return frame(cn.execute(q, args), cols)
+    except (FileNotFoundError, *db.ERRORS):
+        return pd.DataFrame(columns=cols)
+
+
+@metrics.timed("query_seconds", op="regions")
+def region_summary(event_type=None, since=None, path=None):
+    # Per-region count, max and mean intensity from the hourly rollup.
+    cols = ["region", "event_type", "n", "max", "mean"]
+    try:
+        with reader(path) as cn:
+            return frame(regions.summary(cn, event_type, since), cols)
+    except (FileNotFoundError, *db.ERRORS):
+        return pd.DataFrame(columns=cols)
+
+
+@metrics.timed("query_seconds", op="bbox")
+def query_bbox(lat0, lat1, lon0, lon1, event_type=None, columns=COLUMNS, path=None):
+    try:
+        with reader(path) as cn:
+            if db.has_rtree(cn):
+                q = (
+                    f"SELECT {', '.join('w.' + c for c in columns)} FROM weather_rtree r "
+                    "JOIN weather_data w ON w.id = r.id "
+                    "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?"
+                )
+            else:
+                # Postgres, or a database not yet migrated by the scanner: columns
+                # added after the first release may be missing and come back NULL.
+                have = {d[0] for d in cn.execute("SELECT * FROM weather_data LIMIT 0").description}
+                sel = [f"w.{c}" if c in have else f"NULL AS {c}" for c in columns]
+                q = (
+                    f"SELECT {', '.join(sel)} FROM weather_data w "
+                    "WHERE w.lat >= ? AND w.lat <= ? AND w.lon >= ? AND w.lon <= ?"
+                )
+            args = [lat0, lat1, lon0, lon1]
+            if event_type:
+                q += " AND w.event_type = ?"
+                args.append(event_type)
+            q += " ORDER BY w.id ASC"
+            return frame(cn.execute(q, args), columns)
+    except (FileNotFoundError, *db.ERRORS):
+        return pd.DataFrame(columns=columns)
+
+
+def has_rtree(path=None):
+    try:
+        with reader(path) as cn:
+            return db.has_rtree(cn)
+    except (FileNotFoundError, *db.ERRORS):
+        return False
+
+
+def radius_bbox(lat, lon, km):
+    dlat = km / KM_PER_DEG
+    dlon = km / (KM_PER_DEG * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def haversine(lat, lon, lats, lons):
+    p1, p2 = np.radians(lat), np.radians(lats)
+    a = (
+        np.sin((p2 - p1) / 2) ** 2
+        + np.cos(p1) * np.cos(p2) * np.sin(np.radians(lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_KM * np.arcsin(np.sqrt(a))
+
+
+def query_radius(lat, lon, km, event_type=None, columns=COLUMNS, path=None):
+    df = query_bbox(*radius_bbox(lat, lon, km), event_type, columns, path)
+    if df.empty:
+        df["dist_km"] = []
+        return df
+    df["dist_km"] = haversine(lat, lon, df["lat"].to_numpy(), df["lon"].to_numpy())
+    return df[df["dist_km"] <= km].sort_values("dist_km")
+
+
+def view_bbox(lat, lon, zoom, width=1200, height=600):
+    # Web-mercator extent of a pydeck ViewState rendered at width x height px.
+    deg = 360.0 / (256 * 2**zoom)
+    half_w = deg * width / 2
+    half_h = deg * height / 2 * max(math.cos(math.radians(lat)), 0.01)
+    return (
+        max(-90.0, lat - half_h),
+        min(90.0, lat + half_h),
+        lon - half_w,
+        lon + half_w,
+    )
+
+
+@metrics.timed("query_seconds", op="page_events")
+def page_events(
+    event_type=None,
+    bbox=None,
+    since=None,
+    until=None,
+    after_id=0,
+    limit=1000,
+    columns=COLUMNS + ["obs_time"],
+    path=None,
+):
+    # Keyset pagination on id: callers pass the last id they saw as after_id.
+    src = "weather_data w"
+    cond, args = ["w.id > ?"], [after_id]
+    if bbox:
+        if has_rtree(path):
+            src = "weather_rtree r JOIN weather_data w ON w.id = r.id"
+            cond.append("r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?")
+        else:
+            cond.append("w.lat >= ? AND w.lat <= ? AND w.lon >= ? AND w.lon <= ?")
+        args.extend(bbox)
+    if event_type:
+        cond.append("w.event_type = ?")
+        args.append(event_type)
+    if since:
+        cond.append("w.obs_time >= ?")
+        args.append(str(since))
+    if until:
+        cond.append("w.obs_time < ?")
+        args.append(str(until))
+
+    q = (
+        f"SELECT {', '.join('w.' + c for c in columns)} FROM {src} "
+        f"WHERE {' AND '.join(cond)} ORDER BY w.id ASC LIMIT ?"
+    )
+    with reader(path) as cn:
+        return [dict(zip(columns, r)) for r in cn.execute(q, args + [limit])]
+
+
+@metrics.timed("query_seconds", op="page_alerts")
+def page_alerts(event_type=None, pending=None, after_id=0, limit=1000, path=None):
+    cols = ["id", "timestamp", "latitude", "longitude", "region_name", "event_type", "severity", "value", "is_notified"]
+    cond, args = ["id > ?"], [after_id]
+    if event_type:
+        cond.append("event_type = ?")
+        args.append(event_type)
+    if pending is not None:
+        cond.append("is_notified = ?")
+        args.append(not pending)
+    q = f"SELECT {', '.join(cols)} FROM weatheralert WHERE {' AND '.join(cond)} ORDER BY id ASC LIMIT ?"
+    with reader(path) as cn:
+        return [dict(zip(cols, r)) for r in cn.execute(q, args + [limit])]
@@ -0,0 +1,19 @@
+event_order = [
+    "cyclone",
+    "heatwave",
+    "coldwave",
+    "sandstorm",
+    "rainfall",
+    "cloudburst",
+    "monsoon",
+]
+
+meta = {
+    "cyclone": ["🚨", "WIND (KM/H)", 1],
+    "heatwave": ["🔥", "TEMP (°C)", 2.8],
+    "coldwave": ["❄️", "TEMP (°C)", 2.8],
+    "sandstorm": ["🌪️", "WIND (KM/H)", 1],
+    "rainfall": ["🌧️", "RAIN (MM)", 1],
+    "cloudburst": ["⚡", "RATE (MM/HR)", 0.8],
+    "monsoon": ["⛈️", "RAIN (MM)", 1],
+}
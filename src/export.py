@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from h5io import DATA_DIR
+
+EXPORT_DIR = os.environ.get("AMBARAM_EXPORT_DIR", "exports")
+CHUNK = 1 << 20
+KEEP = 4
+
+_pool = ThreadPoolExecutor(max_workers=1)
+_lock = threading.Lock()
+_jobs = {}
+
+
+def archive_key(data_dir, files):
+    h = hashlib.sha1()
+    for f in sorted(files):
+        st = os.stat(os.path.join(data_dir, f))
+        h.update(f"{f}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def write_zip(data_dir, files, dest):
+    # HDF5 granules are already compressed internally, so entries are STORED
+    # and copied through in CHUNK-sized pieces instead of being held in memory.
+    tmp = dest + ".part"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for f in sorted(files):
+            with open(os.path.join(data_dir, f), "rb") as src:
+                with zf.open(f, "w", force_zip64=True) as dst:
+                    shutil.copyfileobj(src, dst, CHUNK)
+    os.replace(tmp, dest)
+    _prune()
+    return dest
+
+
+def _prune():
+    zips = [os.path.join(EXPORT_DIR, x) for x in os.listdir(EXPORT_DIR) if x.endswith(".zip")]
+    zips.sort(key=os.path.getmtime, reverse=True)
+    for p in zips[KEEP:]:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+def archive_path(data_dir, files):
+    return os.path.join(EXPORT_DIR, archive_key(data_dir, files) + ".zip")
+
+
+def ready(data_dir, files):
+    # Path of the cached archive for `files`, or None; never starts a job.
+    path = archive_path(data_dir, files)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    return None
+
+
+def request(data_dir, files):
+    # Returns (path, job). job is None when a cached archive is ready,
+    # otherwise a Future shared by every caller asking for the same file set.
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = archive_path(data_dir, files)
+    with _lock:
+        if os.path.exists(path):
+            os.utime(path)
+            return path, None
+        job = _jobs.get(path)
+        if job is None or job.done():
+            job = _pool.submit(write_zip, data_dir, list(files), path)
+            _jobs[path] = job
+        return path, job
+
+
+def locate(key):
+    # Finished archive for a key from archive_key(), or None.
+    if not re.fullmatch(r"[0-9a-f]{16}", key):
+        return None
+    path = os.path.join(EXPORT_DIR, key + ".zip")
+    return path if os.path.exists(path) else None
+
+
+def raw_file(name, data_dir=DATA_DIR):
+    # A granule straight from the data folder; only plain .h5/.he5 names.
+    if os.path.basename(name) != name or not name.endswith((".h5", ".he5")):
+        return None
+    path = os.path.join(data_dir, name)
+    return path if os.path.isfile(path) else None
+
+
+def stream(path, chunk=CHUNK):
+    with open(path, "rb") as fp:
+        for blk in iter(lambda: fp.read(chunk), b""):
+            yield blk
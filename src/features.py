@@ -0,0 +1,189 @@
+import numpy as np
+
+from h5io import FIELDS, LUT, pick, read_rows, row_step
+
+COLD_BT = 235.0  # K, cold convective cloud top
+DEEP_BT = 210.0  # K, overshooting / very deep convection
+MIN_PIXELS = 20
+CYCLONE_PIXELS = 2000
+
+# 8-connectivity for both the in-strip labelling and the strip seams.
+STRUCT = np.ones((3, 3), dtype=bool)
+
+
+class Field:
+    # A granule dataset read row strip by row strip, converted to physical
+    # units (fill masking, scale/offset, counts -> value lookup table).
+    def __init__(self, f, name, shape, field=None):
+        self.ds = f[name]
+        self.lut = None
+        if name in LUT and LUT[name] in f:
+            self.lut = np.asarray(f[LUT[name]][()], dtype=np.float64).ravel()
+        dims = [n for n in self.ds.shape if n != 1]
+        if dims[-2:] == list(shape):
+            self.kind = "grid"
+        elif len(dims) == 1 and dims[0] == shape[0] == shape[1]:
+            # Square grid: the length cannot tell, so a 1-D longitude runs
+            # along the columns and anything else (latitude) down the rows.
+            self.kind = "col" if field == "lon" else "row"
+        elif dims == [shape[0]]:
+            self.kind = "row"
+        elif dims == [shape[1]]:
+            self.kind = "col"
+        else:
+            self.kind = None
+
+    def rows(self, sl, width):
+        if self.kind == "col":
+            blk = read_rows(self.ds, slice(None))
+            blk = np.broadcast_to(blk, (sl.stop - sl.start, width))
+        else:
+            blk = read_rows(self.ds, sl)
+            if self.kind == "row":
+                blk = np.broadcast_to(blk[:, None], (len(blk), width))
+        if self.lut is not None:
+            ok = np.isfinite(blk) & (blk >= 0) & (blk < len(self.lut))
+            out = np.full(blk.shape, np.nan)
+            out[ok] = self.lut[blk[ok].astype(np.int64)]
+            blk = out
+        return blk
+
+
+class _Regions:
+    # Running per-label sums plus a union-find over labels, so components
+    # that cross strip seams are merged without keeping earlier strips.
+    NAMES = ["n", "lat", "lon", "bt", "ins", "n_ins", "moist", "n_moist"]
+
+    def __init__(self):
+        self.parent = np.zeros(1, dtype=np.int64)
+        self.sums = {k: np.zeros(1) for k in self.NAMES}
+        self.bt_min = np.full(1, np.inf)
+
+    def add(self, lab, n, lat, lon, bt, ins, moist):
+        base = len(self.parent)
+        self.parent = np.concatenate([self.parent, np.arange(base, base + n)])
+        idx = lab.ravel()
+        sel = idx > 0
+        idx = idx[sel] - 1
+        vals = {
+            "n": np.ones(idx.size),
+            "lat": lat.ravel()[sel],
+            "lon": lon.ravel()[sel],
+            "bt": bt.ravel()[sel],
+        }
+        for k, v in (("ins", ins), ("moist", moist)):
+            v = v.ravel()[sel] if v is not None else np.full(idx.size, np.nan)
+            ok = np.isfinite(v)
+            vals[k] = np.where(ok, v, 0.0)
+            vals["n_" + k] = ok.astype(np.float64)
+        for k in self.NAMES:
+            self.sums[k] = np.concatenate([self.sums[k], np.bincount(idx, vals[k], minlength=n)])
+        mins = np.full(n, np.inf)
+        np.minimum.at(mins, idx, vals["bt"])
+        self.bt_min = np.concatenate([self.bt_min, mins])
+        return base
+
+    def root(self, i):
+        p = self.parent
+        while p[i] != i:
+            p[i] = p[p[i]]
+            i = p[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.root(a), self.root(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+    def result(self):
+        roots = np.array([self.root(i) for i in range(len(self.parent))], dtype=np.int64)
+        n = len(roots)
+        tot = {k: np.bincount(roots, v, minlength=n) for k, v in self.sums.items()}
+        bt_min = np.full(n, np.inf)
+        np.minimum.at(bt_min, roots, self.bt_min)
+        keep = np.flatnonzero(tot["n"] >= MIN_PIXELS)
+        keep = keep[keep > 0]
+        return tot, bt_min, keep
+
+
+def _seam(reg, prev, cur):
+    # Pairs of labels touching across the strip boundary (8-connected).
+    for shift in (-1, 0, 1):
+        a = prev[max(0, shift) : len(prev) + min(0, shift)]
+        b = cur[max(0, -shift) : len(cur) + min(0, -shift)]
+        hit = (a > 0) & (b > 0)
+        for x, y in set(zip(a[hit].tolist(), b[hit].tolist())):
+            reg.union(x, y)
+
+
+def classify(pixels, bt_mean, bt_min):
+    if pixels >= CYCLONE_PIXELS and bt_min <= DEEP_BT:
+        return "cyclone", 30.0 + 2.5 * (COLD_BT - bt_mean) + 1.0 * (DEEP_BT - bt_min)
+    if bt_min <= DEEP_BT:
+        return "cloudburst", 0.8 * (60.0 + 3.0 * (COLD_BT - bt_min))
+    return "rainfall", 20.0 + 4.0 * (COLD_BT - bt_mean)
+
+
+def has_bt(f):
+    return pick(f.keys(), FIELDS["bt"]) is not None
+
+
+def extract(f, chunk=None):
+    # Cold-cloud regions of an open granule, one dict per connected region.
+    from scipy import ndimage
+
+    k_bt = pick(f.keys(), FIELDS["bt"])
+    k_lat = pick(f.keys(), FIELDS["lat"])
+    k_lon = pick(f.keys(), FIELDS["lon"])
+    if not (k_bt and k_lat and k_lon):
+        return []
+
+    bt_ds = f[k_bt]
+    shape = [n for n in bt_ds.shape if n != 1][-2:]
+    if len(shape) != 2:
+        return []
+    fields = {"bt": Field(f, k_bt, shape), "lat": Field(f, k_lat, shape, "lat"), "lon": Field(f, k_lon, shape, "lon")}
+    for key, field in (("ins", "insolation"), ("moist", "moisture")):
+        k = pick(f.keys(), FIELDS[field])
+        if k and k != k_bt:
+            fld = Field(f, k, shape)
+            if fld.kind:
+                fields[key] = fld
+    if fields["lat"].kind is None or fields["lon"].kind is None:
+        return []
+
+    reg = _Regions()
+    prev = None
+    step = row_step(bt_ds, chunk)
+    for i in range(0, shape[0], step):
+        sl = slice(i, min(i + step, shape[0]))
+        bt = fields["bt"].rows(sl, shape[1])
+        lab, n = ndimage.label(np.isfinite(bt) & (bt < COLD_BT), structure=STRUCT)
+        if n:
+            blk = {k: fld.rows(sl, shape[1]) for k, fld in fields.items() if k != "bt"}
+            base = reg.add(lab, n, blk["lat"], blk["lon"], bt, blk.get("ins"), blk.get("moist"))
+            lab = np.where(lab > 0, lab + base - 1, 0)
+            if prev is not None:
+                _seam(reg, prev, lab[0])
+        prev = lab[-1]
+
+    tot, bt_min, keep = reg.result()
+    out = []
+    for r in keep:
+        n = tot["n"][r]
+        bt_mean = tot["bt"][r] / n
+        typ, val = classify(n, bt_mean, bt_min[r])
+        out.append(
+            {
+                "lat": float(tot["lat"][r] / n),
+                "lon": float(tot["lon"][r] / n),
+                "bt": float(bt_mean),
+                "bt_min": float(bt_min[r]),
+                "insolation": float(tot["ins"][r] / tot["n_ins"][r]) if tot["n_ins"][r] else None,
+                "moisture": float(tot["moist"][r] / tot["n_moist"][r]) if tot["n_moist"][r] else None,
+                "pixels": int(n),
+                "event_type": typ,
+                "intensity": float(val),
+            }
+        )
+    return out
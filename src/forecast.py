@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import db
+
+STEPS = 3
+DECAY = 0.95
+MOVE = (0.2, -0.15)
+
+# Per-event overrides of MOVE (deg lat, deg lon per step) and DECAY.
+motion = {}
+decay = {}
+
+defaults = {"bt": 300.0, "insolation": 800.0, "moisture": 60.0}
+
+
+def propagate(lat, lon, intensity, steps=STEPS, move=MOVE, rate=DECAY, shift=None):
+    # Every argument may be a scalar or one value (row for `move`) per zone.
+    # Returns (n, steps) arrays of lat, lon and intensity.
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    intensity = np.asarray(intensity, dtype=np.float64)
+    move = np.broadcast_to(np.asarray(move, dtype=np.float64), (len(lat), 2))
+    rate = np.broadcast_to(np.asarray(rate, dtype=np.float64), (len(lat),))
+
+    k = np.arange(1, steps + 1, dtype=np.float64)
+    f_lat = lat[:, None] + move[:, :1] * k
+    f_lon = lon[:, None] + move[:, 1:] * k
+    f_int = intensity[:, None] * rate[:, None] ** k
+    if shift is not None:
+        f_int += np.asarray(shift, dtype=np.float64)[:, None] * k
+    return f_lat, f_lon, f_int
+
+
+def predict(df, steps=STEPS, zones=None, ai=None, move=None):
+    if len(df) < 1:
+        return pd.DataFrame(columns=["zone", "step", "lat", "lon", "intensity", "event_type"])
+    if zones:
+        df = df.tail(zones)
+
+    typ = df["event_type"].to_numpy() if "event_type" in df else np.full(len(df), "")
+    if move is None:
+        move = np.array([motion.get(t, MOVE) for t in typ])
+    rate = np.array([decay.get(t, DECAY) for t in typ])
+
+    shift = None
+    if ai is not None and ai.loaded:
+        cols = {c: df[c].fillna(v) if c in df else np.full(len(df), v) for c, v in defaults.items()}
+        out = ai.predict_batch(df["lat"], df["lon"], cols["bt"], cols["insolation"], cols["moisture"])
+        shift = out["predicted_intensity"] - 100
+
+    f_lat, f_lon, f_int = propagate(
+        df["lat"], df["lon"], df["intensity"], steps, move, rate, shift
+    )
+    n = len(df)
+    return pd.DataFrame(
+        {
+            "zone": np.repeat(df.index.to_numpy(), steps),
+            "step": np.tile(np.arange(1, steps + 1), n),
+            "lat": f_lat.ravel(),
+            "lon": f_lon.ravel(),
+            "intensity": f_int.ravel(),
+            "event_type": np.repeat(typ, steps),
+        }
+    )
+
+
+# Precomputed forecasts: after each commit that changes weather_data, the
+# ingest pipeline refills the `forecast` table for the active zones only,
+# i.e. each event type's detections in its newest granule. Readers never
+# run the model.
+_ai = None
+_ai_mtime = None
+
+
+def default_ai():
+    # WeatherAI if torch and the weights are available, else None (pure
+    # extrapolation). A failed load is retried only once the weights file
+    # appears or its mtime changes, like registry.get.
+    global _ai, _ai_mtime
+    try:
+        from inference import MODEL_PATH, WeatherAI
+    except ImportError:
+        return None
+    mtime = os.path.getmtime(MODEL_PATH) if os.path.exists(MODEL_PATH) else None
+    if _ai is None or (not _ai.loaded and mtime != _ai_mtime):
+        _ai, _ai_mtime = WeatherAI(), mtime
+    return _ai if _ai.loaded else None
+
+
+def model_version(ai):
+    # (label stored with each row, integer kept in scan_meta)
+    if ai is None or not ai.loaded or not os.path.exists(ai.path):
+        return "extrapolation", 0
+    mtime = int(os.path.getmtime(ai.path))
+    return f"{os.path.basename(ai.path)}@{mtime}", mtime
+
+
+def active(cn, cols):
+    # Rows of the newest obs_time per event type.
+    out = []
+    latest = cn.execute(
+        "SELECT event_type, MAX(obs_time) FROM weather_data WHERE obs_time IS NOT NULL GROUP BY event_type"
+    ).fetchall()
+    for typ, t in latest:
+        out += cn.execute(
+            f"SELECT {', '.join(cols)} FROM weather_data WHERE event_type = ? AND obs_time = ? ORDER BY id",
+            (typ, t),
+        ).fetchall()
+    return pd.DataFrame(out, columns=cols).set_index("id")
+
+
+def refresh(cn, ai=None, steps=STEPS):
+    # Returns the number of zones forecast, 0 when nothing changed.
+    import tracker  # imports this module for its motion defaults
+
+    label, mver = model_version(ai)
+    cols = ["id", "lat", "lon", "intensity", "event_type", "track_id"] + list(defaults)
+    with db.transaction(cn):
+        dver = db.data_version(cn, "rows_version")
+        if db.get_meta(cn, "forecast_rows") == dver and db.get_meta(cn, "forecast_model") == mver:
+            return 0
+        cn.execute("DELETE FROM forecast")
+        df = active(cn, cols)
+        if len(df):
+            fut = predict(df, steps, ai=ai, move=tracker.motion(cn, df))
+            out = fut[["event_type", "zone", "step", "lat", "lon", "intensity"]].astype(
+                {"zone": "int64", "step": "int64", "lat": "float64", "lon": "float64", "intensity": "float64"}
+            )
+            cn.executemany(
+                "INSERT INTO forecast (event_type, zone, step, lat, lon, intensity, model_version, data_version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*r, label, dver) for r in out.itertuples(index=False)],
+            )
+        db.set_meta(cn, "forecast_rows", dver)
+        db.set_meta(cn, "forecast_model", mver)
+        db.bump_version(cn)
+    return len(df)
@@ -0,0 +1,94 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from h5io import DATA_DIR, FIELDS, LUT, granule_time, pick
+
+CHUNKS = {"y": 1024, "x": 1024}
+
+
+def _yx(da):
+    # Name the two spatial (phony) dims y/x and drop a length-1 time axis so
+    # every granule contributes one (y, x) slice.
+    for d in da.dims[:-2]:
+        if da.sizes[d] == 1:
+            da = da.isel({d: 0}, drop=True)
+    if da.ndim >= 2:
+        da = da.rename({da.dims[-2]: "y", da.dims[-1]: "x"})
+    return da
+
+
+def _lookup(counts, lut):
+    table = np.asarray(lut.values, dtype=np.float32).ravel()
+    last = len(table) - 1
+
+    def take(c):
+        c = np.asarray(c)
+        ok = (c >= 0) & (c <= last)
+        out = np.full(c.shape, np.nan, dtype=np.float32)
+        out[ok] = table[c[ok].astype(np.int64)]
+        return out
+
+    return counts.copy(data=counts.data.map_blocks(take, dtype=np.float32))
+
+
+def standardize(ds):
+    import xarray as xr
+
+    out = {}
+    for field, names in FIELDS.items():
+        k = pick(ds.data_vars, names)
+        if k is None:
+            continue
+        da = ds[k]
+        if k in LUT and LUT[k] in ds.data_vars and field != "insolation":
+            da = _lookup(da, ds[LUT[k]])
+        out[field] = _yx(da).astype(np.float32)
+
+    std = xr.Dataset(out)
+    src = ds.encoding.get("source", "")
+    name = os.path.basename(src)
+    mtime = os.path.getmtime(src) if src and os.path.exists(src) else 0
+    return std.expand_dims(time=[np.datetime64(granule_time(name, mtime))]).assign_coords(
+        file=("time", [name])
+    )
+
+
+def open_archive(data_dir=DATA_DIR, patterns=("*.h5", "*.he5"), chunks=CHUNKS, parallel=True):
+    import xarray as xr
+
+    paths = sorted(p for pat in patterns for p in glob.glob(os.path.join(data_dir, pat)))
+    if not paths:
+        raise FileNotFoundError(f"no granules in {data_dir}")
+
+    ds = xr.open_mfdataset(
+        paths,
+        engine="h5netcdf",
+        phony_dims="sort",
+        preprocess=standardize,
+        combine="nested",
+        concat_dim="time",
+        data_vars="all",
+        coords="minimal",
+        compat="override",
+        parallel=parallel,
+        chunks={},
+    )
+    ds = ds.sortby("time")
+    return ds.chunk({d: c for d, c in chunks.items() if d in ds.dims})
+
+
+def field_means(ds):
+    # One row per granule time: mean of every field, computed over dask chunks.
+    import dask
+
+    names = [v for v in ("lat", "lon", "bt", "insolation", "moisture") if v in ds]
+    means = [ds[v].mean(dim=[d for d in ds[v].dims if d != "time"], skipna=True) for v in names]
+    vals = dask.compute(*means)
+    df = {"time": ds["time"].values, "file": ds["file"].values}
+    for v, m in zip(names, vals):
+        df[v] = np.asarray(m)
+
+    return pd.DataFrame(df)
@@ -0,0 +1,103 @@
+import os
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+DATA_DIR = os.path.join("..", "data")
+CHUNK_ELEMS = int(os.environ.get("AMBARAM_CHUNK_ELEMS", 1 << 22))
+
+# Candidate dataset names per field, in order of preference. INSAT-3D L1
+# products store brightness temperature as grey counts (IMG_TIR1) plus a
+# lookup table (IMG_TIR1_TEMP); L2 products store the geophysical value.
+FIELDS = {
+    "bt": ["IMG_TIR1", "BT", "TB", "Brightness_Temperature", "CTBT"],
+    "insolation": ["INS", "Insolation", "IMG_VIS_ALBEDO", "IMG_VIS"],
+    "moisture": ["HEM", "TPW", "Moisture", "IMG_WV", "UTH"],
+    "lat": ["Latitude", "latitude", "lat", "Lat"],
+    "lon": ["Longitude", "longitude", "lon", "Lon"],
+}
+LUT = {"IMG_TIR1": "IMG_TIR1_TEMP", "IMG_WV": "IMG_WV_TEMP", "IMG_VIS": "IMG_VIS_ALBEDO"}
+
+
+def pick(keys, names):
+    # First of `names` present in `keys`, exact match before case-insensitive.
+    keys = list(keys)
+    low = {k.lower(): k for k in keys}
+    for n in names:
+        if n in keys:
+            return n
+        if n.lower() in low:
+            return low[n.lower()]
+    return None
+
+
+def fill_values(ds):
+    vals = []
+    for k in ("_FillValue", "FillValue", "fill_value", "missing_value"):
+        if k in ds.attrs:
+            vals.extend(np.atleast_1d(ds.attrs[k]).tolist())
+    if ds.fillvalue is not None and ds.fillvalue != 0:
+        vals.append(ds.fillvalue)
+    return vals
+
+
+def leading(ds):
+    # Leading length-1 axes (e.g. a time axis of one) are skipped when slicing rows.
+    n = 0
+    while n < ds.ndim - 1 and ds.shape[n] == 1:
+        n += 1
+    return n
+
+
+def row_step(ds, chunk=None):
+    chunk = chunk or CHUNK_ELEMS
+    lead = leading(ds)
+    row = int(np.prod(ds.shape[lead + 1 :])) or 1
+    step = max(1, chunk // row)
+    if ds.chunks and step >= ds.chunks[lead]:
+        step -= step % ds.chunks[lead]
+    return step
+
+
+def read_rows(ds, sl):
+    if ds.ndim == 0:
+        return _mask(np.atleast_1d(ds[()]), ds)
+    return _mask(ds[(0,) * leading(ds) + (sl,)], ds)
+
+
+def iter_blocks(ds, chunk=None):
+    # Yields (row_slice, masked float block) so callers never hold more
+    # than `chunk` elements of a dataset in memory.
+    if ds.ndim == 0:
+        yield slice(0, 1), read_rows(ds, None)
+        return
+
+    n = ds.shape[leading(ds)]
+    step = row_step(ds, chunk)
+    for i in range(0, n, step):
+        sl = slice(i, min(i + step, n))
+        yield sl, read_rows(ds, sl)
+
+
+def _mask(blk, ds):
+    blk = np.asarray(blk, dtype=np.float64)
+    for v in fill_values(ds):
+        blk[blk == v] = np.nan
+    scale = float(np.atleast_1d(ds.attrs.get("scale_factor", 1.0))[0])
+    offset = float(np.atleast_1d(ds.attrs.get("add_offset", 0.0))[0])
+    if scale != 1.0 or offset != 0.0:
+        blk = blk * scale + offset
+    return blk
+
+
+def granule_time(name, mtime):
+    # INSAT-3D products are named like 3DIMG_24MAY2024_0000_L1C_ASIA_MER.h5
+    m = re.search(r"_(\d{2}[A-Z]{3}\d{4})_(\d{4})", name.upper())
+    if m:
+        try:
+            t = datetime.strptime(m.group(1) + m.group(2), "%d%b%Y%H%M")
+            return t.strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+# Fixed binning extent (lat0, lat1, lon0, lon1) around the Indian region, so
+# the number of cells per level does not depend on how many rows there are.
+REGION = (5.0, 40.0, 65.0, 100.0)
+
+# Map zoom level -> cell size in degrees.
+LEVELS = {3: 1.0, 4: 0.5, 5: 0.25, 6: 0.1}
+
+
+def bin_cells(lat, lon, val, cell, region=REGION):
+    lat0, lat1, lon0, lon1 = region
+    ny = int(np.ceil((lat1 - lat0) / cell))
+    nx = int(np.ceil((lon1 - lon0) / cell))
+
+    iy = np.floor((np.asarray(lat, dtype=np.float64) - lat0) / cell)
+    ix = np.floor((np.asarray(lon, dtype=np.float64) - lon0) / cell)
+    ok = (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+    flat = (iy[ok] * nx + ix[ok]).astype(np.int64)
+    val = np.asarray(val, dtype=np.float64)[ok]
+
+    tot = np.bincount(flat, weights=val, minlength=ny * nx)
+    cnt = np.bincount(flat, minlength=ny * nx)
+    idx = np.flatnonzero(cnt)
+    return pd.DataFrame(
+        {
+            "lat": lat0 + (idx // nx + 0.5) * cell,
+            "lon": lon0 + (idx % nx + 0.5) * cell,
+            "weight": tot[idx],
+            "real_val": tot[idx] / cnt[idx],
+            "count": cnt[idx],
+        }
+    )
+
+
+def build_levels(lat, lon, val, levels=LEVELS):
+    return {z: bin_cells(lat, lon, val, c) for z, c in levels.items()}
+
+
+def pick_level(zoom, levels=LEVELS):
+    lower = [z for z in levels if z <= zoom]
+    return max(lower) if lower else min(levels)
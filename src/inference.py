@@ -4,7 +4,12 @@ import numpy as np
 import torch
 import torch.nn as nn
 
-MODEL_PATH = os.path.join("models", "cyclone_model.pth")
+import metrics
+import registry
+
+MODEL_PATH = registry.MODEL_PATH
+FEATURES = ["lat", "lon", "bt", "insolation", "moisture"]
+BATCH_SIZE = 65536
 
 
 class CyclonePredictor(nn.Module):
@@ -23,21 +28,34 @@ class CyclonePredictor(nn.Module):
 
 
 class WeatherAI:
-    def __init__(self):
-        self.model = CyclonePredictor()
+    def __init__(self, path=MODEL_PATH, optimize=registry.OPTIMIZE):
+        self.path = path
+        self.optimize = optimize
+        self._model = None
         self.loaded = False
 
-        if os.path.exists(MODEL_PATH):
+        if os.path.exists(path):
             try:
-                self.model.load_state_dict(torch.load(MODEL_PATH))
-                self.model.eval()
+                self._model = registry.get(path, optimize)
                 self.loaded = True
-                print(f"AI Model loaded from {MODEL_PATH}")
+                print(f"AI Model loaded from {path}")
             except Exception as e:
                 print(f"Model load failed: {e}")
         else:
-            print(f"Model file not found at {MODEL_PATH}")
+            print(f"Model file not found at {path}")
+
+    @property
+    def model(self):
+        # Re-resolved on every call so weights published by train.py are
+        # picked up without a restart; the last good model is kept if the
+        # new file cannot be loaded.
+        try:
+            self._model = registry.get(self.path, self.optimize)
+        except Exception as e:
+            print(f"Model reload failed: {e}")
+        return self._model
 
+    @metrics.timed("inference_seconds", mode="single")
     def predict(self, lat, lon, bt, insolation, moisture):
         if not self.loaded:
             return None
@@ -48,6 +66,7 @@ class WeatherAI:
 
         with torch.no_grad():
             prediction = self.model(input_data).item()
+        metrics.inc("predictions")
 
         intensity_shift = prediction
         next_lat = lat + (0.1 * abs(intensity_shift))
@@ -59,3 +78,32 @@ class WeatherAI:
             "next_lon": next_lon,
             "risk_score": max(0, min(100, (prediction * 10) + 50)),
         }
+
+    @metrics.timed("inference_seconds", mode="batch")
+    def predict_batch(self, data, *cols, batch_size=BATCH_SIZE):
+        if not self.loaded:
+            return None
+
+        if cols:
+            x = np.column_stack([data, *cols])
+        elif hasattr(data, "columns"):
+            x = data[FEATURES].to_numpy()
+        else:
+            x = np.asarray(data)
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, len(FEATURES))
+
+        shift = np.empty(len(x), dtype=np.float32)
+        model = self.model
+        with torch.inference_mode():
+            for i in range(0, len(x), batch_size):
+                out = model(torch.from_numpy(x[i : i + batch_size]))
+                shift[i : i + batch_size] = out[:, 0].numpy()
+        metrics.inc("predictions", len(x))
+
+        step = 0.1 * np.abs(shift)
+        return {
+            "predicted_intensity": 100 + shift,
+            "next_lat": x[:, 0] + step,
+            "next_lon": x[:, 1] - step,
+            "risk_score": np.clip(shift * 10 + 50, 0, 100),
+        }
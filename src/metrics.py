@@ -0,0 +1,246 @@
+import functools
+import glob
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+PORT = int(os.environ.get("AMBARAM_METRICS_PORT", 9108))
+# Ingest jobs (scanner, watch) dump their registry to metrics.<job>.prom in
+# this folder, in the same spirit as the node_exporter textfile collector;
+# serve() appends them all. Each job's metric names get their own prefix so
+# they never clash with live ones or with each other.
+TEXTFILE_DIR = os.environ.get("AMBARAM_METRICS_DIR", ".")
+WINDOW = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = "ambaram_"
+
+LINE = re.compile(r"^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)")
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _fmt(labels, extra=None):
+    items = list(labels) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def inc(self, name, n=1, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0) + n
+
+    def gauge(self, name, v, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = v
+
+    def observe(self, name, secs, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            t = self.timers.get(k)
+            if t is None:
+                t = self.timers[k] = {"count": 0, "sum": 0.0, "recent": deque(maxlen=WINDOW)}
+            t["count"] += 1
+            t["sum"] += secs
+            t["recent"].append(secs)
+
+    def summary(self, name, **labels):
+        with self.lock:
+            t = self.timers.get(_key(name, labels))
+            if t is None:
+                return None
+            recent = np.array(t["recent"])
+            out = {"count": t["count"], "sum": t["sum"]}
+        for q in QUANTILES:
+            out[q] = float(np.quantile(recent, q))
+        return out
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get(_key(name, labels), 0)
+
+    def render(self, prefix=PREFIX):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timers = sorted((k, dict(v, recent=np.array(v["recent"]))) for k, v in self.timers.items())
+
+        seen = set()
+
+        def head(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for (name, labels), v in counters:
+            head(name, "counter")
+            lines.append(f"{prefix}{name}{_fmt(labels)} {v}")
+        for (name, labels), v in gauges:
+            head(name, "gauge")
+            lines.append(f"{prefix}{name}{_fmt(labels)} {v}")
+        for (name, labels), t in timers:
+            head(name, "summary")
+            for q in QUANTILES:
+                v = float(np.quantile(t["recent"], q))
+                lines.append(f"{prefix}{name}{_fmt(labels, [('quantile', q)])} {v:.6f}")
+            lines.append(f"{prefix}{name}_sum{_fmt(labels)} {t['sum']:.6f}")
+            lines.append(f"{prefix}{name}_count{_fmt(labels)} {t['count']}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+gauge = REGISTRY.gauge
+observe = REGISTRY.observe
+summary = REGISTRY.summary
+counter = REGISTRY.counter
+render = REGISTRY.render
+
+
+@contextmanager
+def timer(name, **labels):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - t, **labels)
+
+
+def timed(name, **labels):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*a, **kw):
+            with timer(name, **labels):
+                return fn(*a, **kw)
+
+        return inner
+
+    return wrap
+
+
+def textfile(job):
+    return os.path.join(TEXTFILE_DIR, f"metrics.{job}.prom")
+
+
+def write(job):
+    path = textfile(job)
+    tmp = path + ".part"
+    with open(tmp, "w") as fp:
+        fp.write(render(f"{PREFIX}{job}_"))
+    os.replace(tmp, path)
+
+
+def read(job=None):
+    # One job's dump, or every job's concatenated.
+    out = []
+    for path in [textfile(job)] if job else sorted(glob.glob(textfile("*"))):
+        try:
+            with open(path) as fp:
+                out.append(fp.read())
+        except OSError:
+            pass
+    return "".join(out)
+
+
+def by_job(name, text=None):
+    # {job: value} of one unlabelled textfile metric, e.g. by_job("files_scanned").
+    out = {}
+    for (k, lab), v in parse(read() if text is None else text).items():
+        job = k[len(PREFIX) : -len(name) - 1]
+        if not lab and k.startswith(PREFIX) and k.endswith("_" + name) and job and "_" not in job:
+            out[job] = v
+    return out
+
+
+def parse(text):
+    # {(name, labels): value} for the sample lines of a Prometheus text dump.
+    out = {}
+    for ln in text.splitlines():
+        m = LINE.match(ln)
+        if m:
+            out[(m.group(1), m.group(2) or "")] = float(m.group(3))
+    return out
+
+
+def exposition():
+    return render() + read()
+
+
+def _with(lab, k, v):
+    return lab[:-1] + f',{k}="{v}"}}' if lab else f'{{{k}="{v}"}}'
+
+
+def stages(text=None):
+    # One row per timer in an exposition: calls, p50/p99 and total time.
+    s = parse(exposition() if text is None else text)
+    rows = []
+    for (name, lab), n in sorted(s.items()):
+        if not name.endswith("_count") or (name[:-6], _with(lab, "quantile", 0.5)) not in s:
+            continue
+        base = name[:-6]
+        rows.append(
+            {
+                "stage": base[len(PREFIX) :] + lab,
+                "calls": int(n),
+                "p50_ms": s[(base, _with(lab, "quantile", 0.5))] * 1e3,
+                "p99_ms": s.get((base, _with(lab, "quantile", 0.99)), float("nan")) * 1e3,
+                "total_s": s.get((base + "_sum", lab), 0.0),
+            }
+        )
+    return rows
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def serve(port=PORT, host="127.0.0.1"):
+    # Idempotent; returns None if the port is taken (e.g. by another process).
+    global _server
+    if _server is None:
+        try:
+            _server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        print(f"Metrics on http://{host}:{port}/metrics")
+    return _server
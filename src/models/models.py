@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import BigInteger
 from sqlmodel import Field, SQLModel
 
 
@@ -18,10 +19,17 @@ class WeatherAlert(SQLModel, table=True):
     value: float
 
     is_notified: bool = Field(default=False)
+    # Set while a dispatcher holds the alert; stale claims are retried.
+    claimed_at: Optional[float] = Field(default=None)
 
 
 class SatelliteLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    file_name: str
+    file_name: str = Field(unique=True)
     processed_at: datetime = Field(default_factory=datetime.utcnow)
     status: str
+
+    # Manifest used by incremental scans
+    file_size: int = Field(default=0, sa_type=BigInteger)
+    mtime: float = Field(default=0.0)
+    file_hash: str = Field(default="")
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+
+import db
+from events import meta
+
+BATCH = 200
+CONCURRENCY = 32
+RETRIES = 4
+BACKOFF = 0.5
+LEASE = 300
+OUTBOX = os.environ.get("AMBARAM_OUTBOX", "outbox")
+
+# Channels suggested by the frontend icons, sent through the file stub until
+# real gateways are configured.
+CHANNELS = ["whatsapp", "telegram", "gmail", "sms"]
+
+
+class RateLimiter:
+    # Token bucket: `rate` sends per second with bursts of up to `burst`.
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Transport(ABC):
+    def __init__(self, name, rate=20):
+        self.name = name
+        self.limit = RateLimiter(rate)
+
+    @abstractmethod
+    async def send(self, alert):
+        pass
+
+
+class FileTransport(Transport):
+    # Offline stub: appends one JSON line per message to OUTBOX/<name>.jsonl.
+    def __init__(self, name, rate=1000, outbox=OUTBOX):
+        super().__init__(name, rate)
+        os.makedirs(outbox, exist_ok=True)
+        self.path = os.path.join(outbox, f"{name}.jsonl")
+        self.lock = asyncio.Lock()
+
+    async def send(self, alert):
+        line = json.dumps({"channel": self.name, "text": message(alert), **alert})
+        async with self.lock:
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(line + "\n")
+
+
+class HttpTransport(Transport):
+    # POSTs the alert as JSON, e.g. to a local gateway or webhook stub.
+    def __init__(self, name, url, rate=20, timeout=10):
+        super().__init__(name, rate)
+        self.url = url
+        self.timeout = timeout
+
+    async def send(self, alert):
+        import requests
+
+        body = {"channel": self.name, "text": message(alert), **alert}
+        r = await asyncio.to_thread(requests.post, self.url, json=body, timeout=self.timeout)
+        r.raise_for_status()
+
+
+def message(a):
+    icon, unit, _ = meta.get(a["event_type"], ["⚠️", "VAL", 1])
+    return (
+        f"{icon} {a['severity']} {a['event_type'].upper()} ALERT: {a['value']:.1f} "
+        f"{unit.split('(')[-1].rstrip(')')} at {a['latitude']:.2f}N {a['longitude']:.2f}E "
+        f"({a['region_name']}) {a['timestamp']}"
+    )
+
+
+def claim(cn, n=BATCH):
+    now = time.time()
+    with db.transaction(cn):
+        rows = cn.execute(
+            "UPDATE weatheralert SET claimed_at = ? WHERE id IN ("
+            "SELECT id FROM weatheralert WHERE is_notified = ? "
+            "AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY id LIMIT ?) "
+            "RETURNING id, timestamp, latitude, longitude, region_name, event_type, severity, value",
+            (now, False, now - LEASE, n),
+        ).fetchall()
+    keys = ["id", "timestamp", "latitude", "longitude", "region_name", "event_type", "severity", "value"]
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def delivered(cn, ids):
+    # {alert id: channels that already accepted it}
+    out = {i: set() for i in ids}
+    for k in range(0, len(ids), 900):
+        part = ids[k : k + 900]
+        q = f"SELECT alert_id, channel FROM alert_delivery WHERE alert_id IN ({', '.join('?' * len(part))})"
+        for i, c in cn.execute(q, part):
+            out[i].add(c)
+    return out
+
+
+def finish(cn, done, sent, failed):
+    # done: (alert id, channel) pairs accepted in this pass, recorded even
+    # when another channel failed so a retry skips them.
+    with db.transaction(cn):
+        cn.executemany(
+            "INSERT INTO alert_delivery (alert_id, channel, delivered_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(alert_id, channel) DO NOTHING",
+            [(i, c, time.time()) for i, c in done],
+        )
+        cn.executemany(
+            "UPDATE weatheralert SET is_notified = ?, claimed_at = NULL WHERE id = ?",
+            [(True, i) for i in sent],
+        )
+        cn.executemany("UPDATE weatheralert SET claimed_at = NULL WHERE id = ?", [(i,) for i in failed])
+        if sent:
+            db.bump_version(cn)
+
+
+async def deliver(tr, alert, sem, retries=RETRIES):
+    for attempt in range(retries + 1):
+        await tr.limit.acquire()
+        try:
+            async with sem:
+                await tr.send(alert)
+            return True
+        except Exception as e:
+            if attempt == retries:
+                print(f"[{tr.name}] alert {alert['id']} failed: {e}")
+                return False
+            await asyncio.sleep(BACKOFF * 2**attempt * (1 + random.random()))
+
+
+async def dispatch(cn, transports, batch=BATCH, concurrency=CONCURRENCY):
+    alerts = claim(cn, batch)
+    if not alerts:
+        return 0, 0
+
+    # Only the channels that have not accepted an alert yet are tried.
+    have = delivered(cn, [a["id"] for a in alerts])
+    todo = [(a, tr) for a in alerts for tr in transports if tr.name not in have[a["id"]]]
+    sem = asyncio.Semaphore(concurrency)
+    ok = await asyncio.gather(*[deliver(tr, a, sem) for a, tr in todo])
+
+    done = [(a["id"], tr.name) for (a, tr), r in zip(todo, ok) if r]
+    for i, c in done:
+        have[i].add(c)
+    # An alert counts as notified once every channel has accepted it.
+    names = {tr.name for tr in transports}
+    sent = [a["id"] for a in alerts if names <= have[a["id"]]]
+    failed = [a["id"] for a in alerts if not names <= have[a["id"]]]
+    finish(cn, done, sent, failed)
+    return len(sent), len(failed)
+
+
+async def serve(transports, interval=5.0, once=False, path=None):
+    cn = db.connect(path)
+    db.init_db(cn)
+    try:
+        while True:
+            sent, failed = await dispatch(cn, transports)
+            if sent or failed:
+                print(f"Notified {sent} alerts ({failed} to retry)")
+            if once and not sent:
+                break
+            if not sent:
+                await asyncio.sleep(interval)
+    finally:
+        cn.close()
+
+
+def default_transports(url=None):
+    if url:
+        return [HttpTransport(c, url) for c in CHANNELS]
+    return [FileTransport(c) for c in CHANNELS]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--once", action="store_true", help="drain pending alerts and exit")
+    ap.add_argument("--http", metavar="URL", help="POST alerts to URL instead of the file outbox")
+    ap.add_argument("--interval", type=float, default=5.0)
+    a = ap.parse_args()
+    asyncio.run(serve(default_transports(a.http), a.interval, a.once))
@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+
+import db
+import metrics
+
+POLYGONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geo", "india_regions.geojson")
+UNASSIGNED = "UNASSIGNED"
+BATCH = 50000
+
+_shapes = {}
+
+
+def shapes(path=POLYGONS):
+    # [(name, [(bbox, ring (k, 2) lon/lat array), ...])] in file order.
+    if path not in _shapes:
+        with open(path) as fp:
+            fc = json.load(fp)
+        out = []
+        for ft in fc["features"]:
+            g = ft["geometry"]
+            polys = g["coordinates"] if g["type"] == "MultiPolygon" else [g["coordinates"]]
+            rings = []
+            for poly in polys:
+                r = np.asarray(poly[0], dtype=np.float64)
+                rings.append(((r[:, 0].min(), r[:, 0].max(), r[:, 1].min(), r[:, 1].max()), r))
+            out.append((ft["properties"]["name"], rings))
+        _shapes[path] = out
+    return _shapes[path]
+
+
+def inside(lon, lat, ring):
+    # Even-odd ray casting, vectorised over points.
+    x0, y0 = ring[:-1, 0], ring[:-1, 1]
+    x1, y1 = ring[1:, 0], ring[1:, 1]
+    px, py = lon[:, None], lat[:, None]
+    cross = (y0 > py) != (y1 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xi = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return (cross & (px < xi)).sum(axis=1) % 2 == 1
+
+
+def lookup(lat, lon, path=POLYGONS):
+    # Region name per point; the first outline containing it wins.
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    out = np.full(len(lat), UNASSIGNED, dtype=object)
+    todo = np.isfinite(lat) & np.isfinite(lon)
+    for name, rings in shapes(path):
+        for (x0, x1, y0, y1), ring in rings:
+            m = np.flatnonzero(todo & (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1))
+            if not len(m):
+                continue
+            hit = m[inside(lon[m], lat[m], ring)]
+            out[hit] = name
+            todo[hit] = False
+    return out
+
+
+def hour(ts):
+    return str(ts)[:13] + ":00:00" if ts else None
+
+
+def _upsert(cn, rows):
+    # rows of (region, event_type, hour, n, max_val, sum_val)
+    top = "MAX" if cn.backend == "sqlite" else "GREATEST"
+    cn.executemany(
+        "INSERT INTO region_rollup (region, event_type, hour, n, max_val, sum_val) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(region, event_type, hour) DO UPDATE SET n = region_rollup.n + excluded.n, "
+        f"max_val = {top}(region_rollup.max_val, excluded.max_val), sum_val = region_rollup.sum_val + excluded.sum_val",
+        rows,
+    )
+
+
+@metrics.timed("region_update_seconds")
+def update(cn, batch=BATCH):
+    # Tags rows past region_hwm with their region and folds them into the
+    # per-region/event/hour rollup. Runs inside the caller's transaction.
+    hwm = db.get_meta(cn, "region_hwm")
+    total = 0
+    while True:
+        rows = cn.execute(
+            "SELECT id, lat, lon, intensity, event_type, obs_time FROM weather_data "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (hwm, batch),
+        ).fetchall()
+        if not rows:
+            break
+        cols = list(zip(*rows))
+        reg = lookup(cols[1], cols[2])
+        cn.executemany(
+            "UPDATE weather_data SET region = ? WHERE id = ?", list(zip(reg.tolist(), cols[0]))
+        )
+
+        agg = {}
+        for r, t, h, v in zip(reg, cols[4], map(hour, cols[5]), cols[3]):
+            if h is None or v is None:
+                continue
+            a = agg.setdefault((r, t, h), [0, v, 0.0])
+            a[0] += 1
+            a[1] = max(a[1], v)
+            a[2] += v
+        _upsert(cn, [(*k, *a) for k, a in agg.items()])
+
+        hwm = rows[-1][0]
+        total += len(rows)
+        if len(rows) < batch:
+            break
+    db.set_meta(cn, "region_hwm", hwm)
+    return total
+
+
+def forget(cn, names):
+    # Rollup keys touched by the rows of `names`; call before deleting them
+    # and pass the result to recompute() afterwards.
+    keys = set()
+    for f in names:
+        for r, t, ts in cn.execute(
+            "SELECT DISTINCT region, event_type, obs_time FROM weather_data WHERE filename = ? AND region IS NOT NULL",
+            (f,),
+        ):
+            if ts:
+                keys.add((r, t, hour(ts)))
+    return keys
+
+
+def recompute(cn, keys):
+    # max cannot be decremented, so affected cells are recounted from rows.
+    if not keys:
+        return
+    hwm = db.get_meta(cn, "region_hwm")
+    cn.executemany(
+        "DELETE FROM region_rollup WHERE region = ? AND event_type = ? AND hour = ?", list(keys)
+    )
+    rows = []
+    for r, t, h in keys:
+        end = h[:13] + ":59:59.999999"
+        n, top, tot = cn.execute(
+            "SELECT COUNT(*), MAX(intensity), SUM(intensity) FROM weather_data "
+            "WHERE region = ? AND event_type = ? AND obs_time >= ? AND obs_time <= ? AND id <= ? AND intensity IS NOT NULL",
+            (r, t, h, end, hwm),
+        ).fetchone()
+        if n:
+            rows.append((r, t, h, n, top, tot))
+    _upsert(cn, rows)
+
+
+def reset(cn):
+    cn.execute("DELETE FROM region_rollup")
+    db.set_meta(cn, "region_hwm", 0)
+
+
+def summary(cn, event_type=None, since=None):
+    # One row per (region, event_type): count, max and mean intensity,
+    # read from the rollup so the cost follows regions x hours, not rows.
+    q = (
+        "SELECT region, event_type, SUM(n), MAX(max_val), SUM(sum_val) / SUM(n) "
+        "FROM region_rollup"
+    )
+    cond, args = [], []
+    if event_type:
+        cond.append("event_type = ?")
+        args.append(event_type)
+    if since:
+        cond.append("hour >= ?")
+        args.append(hour(since))
+    if cond:
+        q += " WHERE " + " AND ".join(cond)
+    q += " GROUP BY region, event_type ORDER BY MAX(max_val) DESC"
+    return cn.execute(q, args)
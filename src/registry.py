@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import threading
+
+# One loaded CyclonePredictor per weights file and process. torch is only
+# imported the first time a model is actually requested.
+OPTIMIZE = os.environ.get("AMBARAM_MODEL_OPT") or None
+MODEL_PATH = os.path.join("models", "cyclone_model.pth")
+
+_lock = threading.Lock()
+_models = {}
+
+
+def get(path, optimize=OPTIMIZE):
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path), optimize)
+    with _lock:
+        if key not in _models:
+            for k in [k for k in _models if k[0] == path]:
+                del _models[k]
+            _models[key] = _load(path, optimize)
+        return _models[key]
+
+
+def _load(path, optimize):
+    import torch
+
+    from inference import CyclonePredictor
+
+    model = CyclonePredictor()
+    model.load_state_dict(
+        torch.load(path, map_location=torch.device("cpu"), weights_only=True)
+    )
+    model.eval()
+
+    if optimize == "quantize":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif optimize == "jit":
+        with torch.inference_mode():
+            model = torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 5)))
+    return model
+
+
+def clear():
+    with _lock:
+        _models.clear()
+
+
+def probe(path=MODEL_PATH, timeout=120):
+    # Whether `path` loads, checked in a child process so the caller never
+    # imports torch.
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        r = subprocess.run(
+            [sys.executable, "-c", "import sys, registry; registry.get(sys.argv[1])", os.path.abspath(path)],
+            cwd=here,
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return False
+    return r.returncode == 0
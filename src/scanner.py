@@ -1,12 +1,27 @@
+import hashlib
 import os
 import random
-import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import h5py
 import numpy as np
 
-DATA_DIR = os.path.join("..", "data")
-DB_FILE = "weather.db"
+import alerts
+import forecast
+import db
+import features
+import metrics
+import regions
+import snapshot
+import tracker
+from h5io import DATA_DIR, granule_time, iter_blocks
+
+DB_FILE = db.target()
+WORKERS = os.cpu_count() or 1
+CY_STEPS = 30
+
+_cache = {}
 
 ev = [
     "cyclone",
@@ -28,107 +43,260 @@ seeds = {
 }
 
 
+def ds_mean(ds, chunk=None):
+    tot, cnt = 0.0, 0
+    for _, blk in iter_blocks(ds, chunk):
+        ok = np.isfinite(blk)
+        tot += float(blk[ok].sum())
+        cnt += int(ok.sum())
+    return tot / cnt if cnt else None
+
+
+def read_coords(f, chunk=None):
+    keys = list(f.keys())
+    k_lat = next((k for k in keys if "lat" in k.lower()), None)
+    k_lon = next((k for k in keys if "lon" in k.lower()), None)
+    if k_lat and k_lon:
+        v1 = ds_mean(f[k_lat], chunk)
+        v2 = ds_mean(f[k_lon], chunk)
+        if v1 is None or v2 is None:
+            return None
+        if v1 < 6 or v1 > 37 or v2 < 68 or v2 > 98:
+            return None
+        return v1, v2
+    return None
+
+
 def get_coords(path):
     try:
         with h5py.File(path, "r") as f:
-            keys = list(f.keys())
-            k_lat = next((k for k in keys if "lat" in k.lower()), None)
-            k_lon = next((k for k in keys if "lon" in k.lower()), None)
-            if k_lat and k_lon:
-                l1 = np.array(f[k_lat])
-                l2 = np.array(f[k_lon])
-                v1 = float(np.mean(l1)) if l1.size > 1 else float(l1.flatten()[0])
-                v2 = float(np.mean(l2)) if l2.size > 1 else float(l2.flatten()[0])
-                if v1 < 6 or v1 > 37 or v2 < 68 or v2 > 98:
-                    return None
-                return v1, v2
-            return None
+            return read_coords(f)
     except:
         return None
 
 
-def run():
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for blk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+
+def scan_file(path):
+    t = time.perf_counter()
+    st = os.stat(path)
+    res = {
+        "coords": None,
+        "regions": [],
+        "has_bt": False,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": file_hash(path),
+    }
+    try:
+        with h5py.File(path, "r") as f:
+            res["coords"] = read_coords(f)
+            res["has_bt"] = features.has_bt(f)
+            res["regions"] = features.extract(f)
+    except Exception as e:
+        print(f"{os.path.basename(path)}: {e}")
+    res["secs"] = time.perf_counter() - t
+    return res
+
+
+def load_files(fls):
+    keys = {}
+    for f in fls:
+        path = os.path.join(DATA_DIR, f)
+        keys[f] = (path, os.path.getmtime(path))
+    jobs = {k: k[0] for k in keys.values() if k not in _cache}
+
+    if jobs:
+        print(f"Reading {len(jobs)} files on {WORKERS} workers...")
+        with ProcessPoolExecutor(max_workers=WORKERS) as ex:
+            for key, res in zip(jobs, ex.map(scan_file, jobs.values(), chunksize=8)):
+                _cache[key] = res
+                # Workers are separate processes, so their timings are
+                # recorded here from what scan_file returns.
+                metrics.observe("scan_file_seconds", res["secs"])
+                metrics.inc("files_scanned")
+                metrics.inc("bytes_scanned", res["size"])
+                metrics.inc("regions_found", len(res["regions"]))
+    metrics.inc("scan_cache_hits", len(keys) - len(jobs))
+
+    return {f: _cache[k] for f, k in keys.items()}
+
+
+def make_rows(f, res, idx, n):
+    ts = granule_time(f, res["mtime"])
+    if res.get("has_bt") or res.get("regions"):
+        # Real brightness temperature: its cold-cloud regions, or nothing
+        # for a clear-sky granule.
+        return [
+            (f, r["lat"], r["lon"], r["intensity"], r["event_type"], ts, r["bt"], r["insolation"], r["moisture"])
+            for r in res["regions"]
+        ]
+
+    # No brightness temperature in this granule: fall back to seeded
+    # synthetic events around its footprint.
+    rng = random.Random(res["hash"])
+    real = res["coords"]
+    rows = []
+
+    for k in range(idx, CY_STEPS, n):
+        cy_lat = 10.0 + 0.25 * (k + 1)
+        cy_lon = 90.0 - 0.18 * (k + 1)
+        v = rng.uniform(90.0, 160.0)
+        rows.append((f, cy_lat, cy_lon, v, "cyclone", ts, None, None, None))
+
+    for typ in ev:
+        if typ == "cyclone":
+            continue
+        count = max(1, rng.randint(30, 50) // n)
+        for i in range(count):
+            if real:
+                base_la, base_lo = real
+            else:
+                base_la, base_lo = rng.choice(seeds[typ])
+
+            spread = 1.2 if typ == "cloudburst" else 2.5
+            la = base_la + rng.uniform(-spread, spread)
+            lo = base_lo + rng.uniform(-spread, spread)
+
+            if typ == "cloudburst":
+                la = min(la, 35.0)
+                lo = min(lo, 80.0)
+            elif typ == "sandstorm":
+                lo = min(lo, 75.0)
+            elif typ == "heatwave":
+                la = min(la, 30.0)
+            elif typ == "coldwave":
+                la = max(la, 26.0)
+
+            la = max(7.0, min(36.0, la))
+            lo = max(68.0, min(97.0, lo))
+            v = rng.uniform(50.0, 150.0)
+            rows.append((f, la, lo, v, typ, ts, None, None, None))
+
+    return rows
+
+
+def manifest(cn):
+    # file_name -> (file_size, mtime, file_hash) as of the last commit.
+    return {
+        r[0]: r[1:]
+        for r in cn.execute("SELECT file_name, file_size, mtime, file_hash FROM satellitelog")
+    }
+
+
+def commit(cn, info, log, pos, total, gone=(), full=False):
+    # Writes the rows and manifest entries for `info` ({file: scan_file
+    # result}) and drops `gone` in one transaction; returns (files, rows).
+    redo = [f for f in info if f not in log or log[f][2] != info[f]["hash"]]
+    rows = []
+    for f in redo:
+        rows.extend(make_rows(f, info[f], pos.get(f, 0), total))
+    logs = [
+        (
+            f,
+            "processed" if res["coords"] else "no_coords",
+            res["size"],
+            res["mtime"],
+            res["hash"],
+        )
+        for f, res in info.items()
+    ]
+
+    with db.transaction(cn):
+        if full:
+            cn.execute("DELETE FROM weather_data")
+            cn.execute("DELETE FROM satellitelog")
+            regions.reset(cn)
+        since = tracker.earliest(cn, list(gone) + redo)
+        keys = regions.forget(cn, list(gone) + redo)
+        db.delete_files(cn, list(gone) + redo)
+        regions.recompute(cn, keys)
+        cn.executemany(
+            "DELETE FROM satellitelog WHERE file_name = ?", [(f,) for f in gone]
+        )
+        n = db.insert_rows(cn, rows)
+        if full:
+            tracker.reset(cn)
+        tracker.update(cn, since)
+        regions.update(cn)
+        cn.executemany(
+            "INSERT INTO satellitelog (file_name, processed_at, status, file_size, mtime, file_hash) VALUES (?, CURRENT_TIMESTAMP, ?, ?, ?, ?) "
+            "ON CONFLICT(file_name) DO UPDATE SET processed_at = excluded.processed_at, status = excluded.status, "
+            "file_size = excluded.file_size, mtime = excluded.mtime, file_hash = excluded.file_hash",
+            logs,
+        )
+        # A rescan that finds nothing new leaves every reader cache valid.
+        if full or gone or redo:
+            db.bump_version(cn)
+            db.bump_version(cn, "rows_version")
+    return len(redo), n
+
+
+def list_files(data_dir=None):
+    ls = os.listdir(data_dir or DATA_DIR)
+    return sorted(x for x in ls if x.endswith(".h5") or x.endswith(".he5"))
+
+
+def run(full=False):
     if not os.path.exists(DATA_DIR):
         print(f"ERROR: Data folder not found at {DATA_DIR}")
         return
 
+    t = time.perf_counter()
     try:
-        print(f"Connecting to database at: {DB_FILE}")
-        cn = sqlite3.connect(DB_FILE)
-        cr = cn.cursor()
-        cr.execute(
-            """CREATE TABLE IF NOT EXISTS weather_data (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT, lat REAL, lon REAL, intensity REAL, event_type TEXT)"""
-        )
-        cr.execute("DELETE FROM weather_data")
-        cn.commit()
+        print(f"Connecting to database at: {db.display(DB_FILE)}")
+        cn = db.connect()
+        db.init_db(cn)
 
-        ls = os.listdir(DATA_DIR)
-        fls = [x for x in ls if x.endswith(".h5") or x.endswith(".he5")]
+        fls = list_files()
 
-        if not fls:
+        if not fls and not full:
             print("No H5 files found in data folder!")
             return
 
-        fls.sort()
-        print(f"Processing {len(fls)} files...")
-
-        cy_count = random.randint(25, 35)
-        cy_lat, cy_lon = 10.0, 90.0
-
-        for i in range(cy_count):
-            f = fls[i % len(fls)]
-            cy_lat += 0.25
-            cy_lon -= 0.18
-            v = random.uniform(90.0, 160.0)
-            cr.execute(
-                "INSERT INTO weather_data (filename, lat, lon, intensity, event_type) VALUES (?, ?, ?, ?, ?)",
-                (f, cy_lat, cy_lon, v, "cyclone"),
-            )
-
-        for typ in ev:
-            if typ == "cyclone":
-                continue
-            count = random.randint(30, 50)
-            for i in range(count):
-                f = fls[i % len(fls)]
-                path = os.path.join(DATA_DIR, f)
-                real = get_coords(path)
-
-                if real:
-                    base_la, base_lo = real
-                else:
-                    base_la, base_lo = random.choice(seeds[typ])
-
-                spread = 1.2 if typ == "cloudburst" else 2.5
-                la = base_la + random.uniform(-spread, spread)
-                lo = base_lo + random.uniform(-spread, spread)
-
-                if typ == "cloudburst":
-                    la = min(la, 35.0)
-                    lo = min(lo, 80.0)
-                elif typ == "sandstorm":
-                    lo = min(lo, 75.0)
-                elif typ == "heatwave":
-                    la = min(la, 30.0)
-                elif typ == "coldwave":
-                    la = max(la, 26.0)
-
-                la = max(7.0, min(36.0, la))
-                lo = max(68.0, min(97.0, lo))
-                v = random.uniform(50.0, 150.0)
-
-                cr.execute(
-                    "INSERT INTO weather_data (filename, lat, lon, intensity, event_type) VALUES (?, ?, ?, ?, ?)",
-                    (f, la, lo, v, typ),
-                )
-
-        cn.commit()
-        print(f"Success! Database updated at {DB_FILE}")
-        cr.close()
+        log = manifest(cn)
+        if full or not log:
+            full = True
+            log = {}
+
+        gone = [f for f in log if f not in fls]
+        todo = []
+        for f in fls:
+            st = os.stat(os.path.join(DATA_DIR, f))
+            if log.get(f, (None, None))[:2] != (st.st_size, st.st_mtime):
+                todo.append(f)
+
+        print(f"Processing {len(todo)} of {len(fls)} files ({len(gone)} removed)...")
+        info = load_files(todo)
+
+        pos = {f: i for i, f in enumerate(fls)}
+        files, n = commit(cn, info, log, pos, len(fls), gone, full)
+
+        print(f"Success! {files} files, {n} rows updated in {db.display(DB_FILE)}")
+        print(f"{alerts.evaluate(cn)} new alerts raised")
+        print(f"Forecasts for {forecast.refresh(cn, forecast.default_ai())} active zones stored")
+        if snapshot.stale(cn):
+            print(f"Snapshot of {snapshot.write(cn)} rows written to {snapshot.location()}")
+        else:
+            print(f"Snapshot at {snapshot.current()} is up to date")
         cn.close()
     except Exception as e:
+        metrics.inc("scan_errors")
         print(f"Error: {e}")
+    metrics.observe("scan_run_seconds", time.perf_counter() - t)
+    metrics.gauge("last_scan_timestamp", round(time.time(), 3))
+    metrics.write("scanner")
 
 
 if __name__ == "__main__":
-    run()
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full", action="store_true", help="rebuild weather_data from scratch")
+    run(full=ap.parse_args().full)
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db
+import metrics
+
+# Columnar copy of weather_data for readers that only need the numeric
+# columns: one .npy per column (float32, event types as uint8 codes), rows
+# grouped by event type so a single type is a zero-copy slice of the mmap.
+DIR = os.environ.get("AMBARAM_SNAPSHOT_DIR", "")
+CURRENT = "CURRENT"
+KEEP = 2
+FLOATS = ["lat", "lon", "intensity"]
+
+_lock = threading.Lock()
+_open = {}
+
+
+def location(db_path=None):
+    # weather.db -> weather_snapshot/, next to the database file.
+    if DIR:
+        return DIR
+    if not db_path or db.is_pg(db_path):
+        db_path = db.DB_FILE
+    return os.path.splitext(db_path)[0] + "_snapshot"
+
+
+@metrics.timed("snapshot_write_seconds")
+def write(cn, path=None):
+    # Reads inside one read transaction so rows and rows_version agree;
+    # under WAL the ingest writer keeps committing meanwhile.
+    cols = {c: [] for c in ["id", "track_id"] + FLOATS}
+    events, offsets, n = [], [0], 0
+    with db.transaction(cn, write=False):
+        ver = db.data_version(cn, "rows_version")
+        types = sorted(r[0] for r in cn.execute("SELECT DISTINCT event_type FROM weather_data") if r[0])
+        for t in types:
+            rows = cn.execute(
+                "SELECT id, lat, lon, intensity, track_id FROM weather_data WHERE event_type = ? ORDER BY id",
+                (t,),
+            ).fetchall()
+            if not rows:
+                continue
+            arr = np.array(rows, dtype=np.float64)
+            cols["id"].append(arr[:, 0].astype(np.int64))
+            cols["track_id"].append(np.nan_to_num(arr[:, 4], nan=-1).astype(np.int64))
+            for i, c in enumerate(FLOATS, 1):
+                cols[c].append(arr[:, i].astype(np.float32))
+            events.append(t)
+            n += len(rows)
+            offsets.append(n)
+
+    path = path or location()
+    out = os.path.join(path, f"v{ver}")
+    tmp = out + ".part"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for c, parts in cols.items():
+        dtype = np.float32 if c in FLOATS else np.int64
+        np.save(os.path.join(tmp, c + ".npy"), np.concatenate(parts) if parts else np.zeros(0, dtype))
+    codes = np.repeat(np.arange(len(events), dtype=np.uint8), np.diff(offsets))
+    np.save(os.path.join(tmp, "event.npy"), codes)
+    with open(os.path.join(tmp, "meta.json"), "w") as fp:
+        json.dump({"version": ver, "rows": n, "events": events, "offsets": offsets}, fp)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+
+    with open(os.path.join(path, CURRENT + ".part"), "w") as fp:
+        fp.write(f"v{ver}")
+    os.replace(os.path.join(path, CURRENT + ".part"), os.path.join(path, CURRENT))
+
+    # Readers that still map an older version keep it alive until they let go.
+    old = sorted(
+        (d for d in os.listdir(path) if d.startswith("v") and d[1:].isdigit() and d != f"v{ver}"),
+        key=lambda d: int(d[1:]),
+    )
+    for d in old[: max(0, len(old) - KEEP + 1)]:
+        shutil.rmtree(os.path.join(path, d), ignore_errors=True)
+    metrics.gauge("snapshot_rows", n)
+    return n
+
+
+def current(path=None):
+    path = path or location()
+    try:
+        with open(os.path.join(path, CURRENT)) as fp:
+            return os.path.join(path, fp.read().strip())
+    except OSError:
+        return None
+
+
+def stale(cn, path=None):
+    # True unless the published snapshot was taken at the current rows_version.
+    d = current(path)
+    return d is None or os.path.basename(d) != f"v{db.data_version(cn, 'rows_version')}"
+
+
+def _columns(d):
+    with _lock:
+        if d not in _open:
+            with open(os.path.join(d, "meta.json")) as fp:
+                meta = json.load(fp)
+            arrs = {
+                c: np.load(os.path.join(d, c + ".npy"), mmap_mode="r")
+                for c in ["id", "track_id", "event"] + FLOATS
+            }
+            _open.clear()
+            _open[d] = meta, arrs
+        return _open[d]
+
+
+def load(event_type=None, version=None, path=None):
+    # DataFrame over the memory-mapped columns, or None when there is no
+    # snapshot or it was taken at another rows_version than `version`.
+    d = current(path)
+    if d is None:
+        return None
+    try:
+        meta, arrs = _columns(d)
+    except (OSError, ValueError):
+        return None
+    if version is not None and meta["version"] != version:
+        return None
+
+    if event_type is None:
+        sl = slice(0, meta["rows"])
+    elif event_type in meta["events"]:
+        i = meta["events"].index(event_type)
+        sl = slice(meta["offsets"][i], meta["offsets"][i + 1])
+    else:
+        sl = slice(0, 0)
+
+    df = {c: arrs[c][sl] for c in ["id"] + FLOATS}
+    df["event_type"] = pd.Categorical.from_codes(arrs["event"][sl], meta["events"])
+    df["track_id"] = arrs["track_id"][sl]
+    return pd.DataFrame(df, copy=False)
@@ -0,0 +1,297 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import db
+import forecast
+import metrics
+
+GATE_KM = 250.0  # max distance between a track's predicted position and a detection
+MAX_GAP_H = 6.0  # tracks not seen for longer than this are closed
+ALPHA = 0.5  # weight of the newest displacement in the velocity estimate
+BATCH = 50000
+KM_PER_DEG = 111.32
+MAX_LAT = 60.0  # grid longitude cells are sized for this latitude
+
+
+def _hours(ts):
+    return datetime.fromisoformat(str(ts)).timestamp() / 3600.0
+
+
+def _km(lat0, lon0, lat1, lon1):
+    # Equirectangular distance; plenty for gating a few hundred km.
+    x = (lon1 - lon0) * np.cos(np.radians((lat0 + lat1) / 2))
+    return KM_PER_DEG * np.hypot(lat1 - lat0, x)
+
+
+class Grid:
+    # Buckets of GATE_KM-sized cells, so each detection is only compared with
+    # tracks in the 3x3 cells around it instead of every open track.
+    def __init__(self, lat, lon, size_km=GATE_KM):
+        self.dlat = size_km / KM_PER_DEG
+        self.dlon = self.dlat / math.cos(math.radians(MAX_LAT))
+        self.cells = defaultdict(list)
+        for j, (la, lo) in enumerate(zip(lat, lon)):
+            self.cells[self.key(la, lo)].append(j)
+
+    def key(self, lat, lon):
+        return int(math.floor(lat / self.dlat)), int(math.floor(lon / self.dlon))
+
+    def near(self, lat, lon):
+        r, c = self.key(lat, lon)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                yield from self.cells.get((r + dr, c + dc), ())
+
+
+def assign(det_lat, det_lon, trk_lat, trk_lon, gate=GATE_KM):
+    # Gated candidate pairs from the grid, then an optimal (Hungarian)
+    # assignment inside each connected group of detections and tracks.
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n, m = len(det_lat), len(trk_lat)
+    if not n or not m:
+        return []
+    grid = Grid(trk_lat, trk_lon, gate)
+    ii, jj = [], []
+    for i in range(n):
+        for j in grid.near(det_lat[i], det_lon[i]):
+            ii.append(i)
+            jj.append(j)
+    if not ii:
+        return []
+    ii, jj = np.array(ii), np.array(jj)
+    d = _km(det_lat[ii], det_lon[ii], trk_lat[jj], trk_lon[jj])
+    ok = d <= gate
+    ii, jj, d = ii[ok], jj[ok], d[ok]
+    if not len(ii):
+        return []
+
+    g = coo_matrix((np.ones(len(ii)), (ii, n + jj)), shape=(n + m, n + m))
+    _, comp = connected_components(g, directed=False)
+    out = []
+    for c in np.unique(comp[ii]):
+        sel = comp[ii] == c
+        di, ti = np.unique(ii[sel]), np.unique(jj[sel])
+        cost = np.full((len(di), len(ti)), gate * 10)
+        cost[np.searchsorted(di, ii[sel]), np.searchsorted(ti, jj[sel])] = d[sel]
+        for r, k in zip(*linear_sum_assignment(cost)):
+            if cost[r, k] <= gate:
+                out.append((int(di[r]), int(ti[k])))
+    return out
+
+
+def _open_tracks(cn):
+    cols = ["id", "event_type", "last_time", "lat", "lon", "intensity", "vlat", "vlon", "hits"]
+    rows = cn.execute(f"SELECT {', '.join(cols)} FROM storm_track WHERE active = ?", (True,)).fetchall()
+    return {r[0]: dict(zip(cols, r)) for r in rows}
+
+
+def _step(k, t, lat, lon, val):
+    # Moves track `k` to a detection at time t.
+    dt = _hours(t) - _hours(k["last_time"])
+    vlat = (lat - k["lat"]) / dt
+    vlon = (lon - k["lon"]) / dt
+    if k["hits"] > 1:
+        vlat = ALPHA * vlat + (1 - ALPHA) * k["vlat"]
+        vlon = ALPHA * vlon + (1 - ALPHA) * k["vlon"]
+    k.update(last_time=t, lat=lat, lon=lon, intensity=val, vlat=vlat, vlon=vlon, hits=k["hits"] + 1)
+
+
+def _frame(tracks, t, typ, ids, lat, lon, val, new_id):
+    # Links one granule's detections of one event type; returns
+    # [(row id, track id)] and mutates/extends `tracks`.
+    h = _hours(t)
+    cand = [
+        k
+        for k in tracks.values()
+        if k["event_type"] == typ and 0 < h - _hours(k["last_time"]) <= MAX_GAP_H
+    ]
+    dt = np.array([h - _hours(k["last_time"]) for k in cand])
+    p_lat = np.array([k["lat"] + k["vlat"] * d for k, d in zip(cand, dt)])
+    p_lon = np.array([k["lon"] + k["vlon"] * d for k, d in zip(cand, dt)])
+
+    links = []
+    hit = set()
+    for i, j in assign(lat, lon, p_lat, p_lon):
+        k = cand[j]
+        _step(k, t, lat[i], lon[i], val[i])
+        k["dirty"] = True
+        links.append((ids[i], k["id"]))
+        hit.add(i)
+
+    for i in range(len(ids)):
+        if i in hit:
+            continue
+        tid = new_id()
+        tracks[tid] = {
+            "id": tid,
+            "event_type": typ,
+            "first_time": t,
+            "last_time": t,
+            "lat": lat[i],
+            "lon": lon[i],
+            "intensity": val[i],
+            "vlat": 0.0,
+            "vlon": 0.0,
+            "hits": 1,
+            "new": True,
+        }
+        links.append((ids[i], tid))
+    return links
+
+
+STATE = ["last_time", "lat", "lon", "intensity", "vlat", "vlon", "hits", "active"]
+
+
+def _values(k):
+    v = {**k, "last_time": str(k["last_time"]), "active": k.get("active", True)}
+    return [v[c] if c in ("last_time", "hits", "active") else float(v[c]) for c in STATE]
+
+
+@metrics.timed("track_update_seconds")
+def update(cn, since=None, batch=BATCH):
+    # Links weather_data rows past the track high-water mark, one granule
+    # time at a time in time order. Rows at or after `since` (removed or
+    # replaced files) or new rows no newer than the latest linked granule
+    # are relinked from that time on. Runs inside the caller's transaction.
+    hwm = db.get_meta(cn, "track_hwm")
+    late, last = cn.execute("SELECT MIN(obs_time), MAX(id) FROM weather_data WHERE id > ?", (hwm,)).fetchone()
+    top = cn.execute("SELECT MAX(last_time) FROM storm_track").fetchone()[0]
+    if late is not None and top is not None and _hours(late) <= _hours(top):
+        since = late if since is None else min(since, late, key=_hours)
+    if since is not None:
+        rewind(cn, since)
+        cond, arg = "obs_time >= ?", since
+    else:
+        cond, arg = "id > ?", hwm
+
+    tracks = _open_tracks(cn)
+    nxt = [cn.execute("SELECT COALESCE(MAX(id), 0) FROM storm_track").fetchone()[0]]
+
+    def new_id():
+        nxt[0] += 1
+        return nxt[0]
+
+    # Batches hold whole granule times so no frame is split across two.
+    times = cn.execute(
+        f"SELECT obs_time, COUNT(*) FROM weather_data WHERE {cond} AND obs_time IS NOT NULL "
+        "GROUP BY obs_time ORDER BY obs_time",
+        (arg,),
+    ).fetchall()
+    links, total, i = [], 0, 0
+    while i < len(times):
+        j, n = i + 1, times[i][1]
+        while j < len(times) and n + times[j][1] <= batch:
+            n += times[j][1]
+            j += 1
+        rows = cn.execute(
+            "SELECT id, obs_time, event_type, lat, lon, intensity FROM weather_data "
+            f"WHERE {cond} AND obs_time >= ? AND obs_time <= ?",
+            (arg, times[i][0], times[j - 1][0]),
+        ).fetchall()
+        rows.sort(key=lambda r: (str(r[1]), r[2], r[0]))
+        start = 0
+        for e in range(1, len(rows) + 1):
+            if e < len(rows) and rows[e][1:3] == rows[start][1:3]:
+                continue
+            grp = rows[start:e]
+            cols = list(zip(*grp))
+            lat, lon, val = (np.array(c, dtype=np.float64) for c in cols[3:6])
+            links += _frame(tracks, grp[0][1], grp[0][2], cols[0], lat, lon, val, new_id)
+            start = e
+        total += len(rows)
+        i = j
+
+    newest = max((_hours(k["last_time"]) for k in tracks.values()), default=0)
+    for k in tracks.values():
+        if newest - _hours(k["last_time"]) > MAX_GAP_H:
+            k["active"] = False
+            k["dirty"] = True
+
+    cn.executemany(
+        f"INSERT INTO storm_track (id, event_type, first_time, {', '.join(STATE)}) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(k["id"], k["event_type"], str(k["first_time"]), *_values(k)) for k in tracks.values() if k.get("new")],
+    )
+    cn.executemany(
+        f"UPDATE storm_track SET {', '.join(c + ' = ?' for c in STATE)} WHERE id = ?",
+        [(*_values(k), k["id"]) for k in tracks.values() if k.get("dirty") and not k.get("new")],
+    )
+    cn.executemany("UPDATE weather_data SET track_id = ? WHERE id = ?", [(t, int(i)) for i, t in links])
+    db.set_meta(cn, "track_hwm", max(hwm, last or 0))
+    metrics.gauge("tracks_open", sum(1 for k in tracks.values() if k.get("active", True)))
+    return total
+
+
+def earliest(cn, names):
+    # Oldest obs_time among the rows of `names`; call before deleting them
+    # and pass the result to update() afterwards.
+    out = None
+    for f in names:
+        t = cn.execute("SELECT MIN(obs_time) FROM weather_data WHERE filename = ?", (f,)).fetchone()[0]
+        if t is not None and (out is None or _hours(t) < _hours(out)):
+            out = t
+    return out
+
+
+def rewind(cn, since):
+    # Undoes the linking at and after `since`: those rows lose their track,
+    # tracks born since then are dropped and the rest are rolled back to
+    # their state at `since` by replaying their earlier detections.
+    cn.execute("UPDATE weather_data SET track_id = NULL WHERE obs_time >= ? AND track_id IS NOT NULL", (since,))
+    cn.execute("DELETE FROM storm_track WHERE first_time >= ?", (since,))
+    ids = [r[0] for r in cn.execute("SELECT id FROM storm_track WHERE last_time >= ?", (since,)).fetchall()]
+    tracks = {}
+    for i in range(0, len(ids), 900):
+        part = ids[i : i + 900]
+        q = (
+            "SELECT track_id, obs_time, lat, lon, intensity FROM weather_data "
+            f"WHERE track_id IN ({', '.join('?' * len(part))}) ORDER BY track_id, obs_time"
+        )
+        for tid, t, lat, lon, val in cn.execute(q, part).fetchall():
+            if tid in tracks:
+                _step(tracks[tid], t, lat, lon, val)
+            else:
+                tracks[tid] = {"id": tid, "last_time": t, "lat": lat, "lon": lon, "intensity": val, "vlat": 0.0, "vlon": 0.0, "hits": 1}
+    cn.executemany("DELETE FROM storm_track WHERE id = ?", [(i,) for i in ids if i not in tracks])
+    cn.executemany(
+        f"UPDATE storm_track SET {', '.join(c + ' = ?' for c in STATE)} WHERE id = ?",
+        [(*_values(k), k["id"]) for k in tracks.values()],
+    )
+    # Tracks that could still take a detection at `since` are open again.
+    cut = datetime.fromisoformat(str(since)) - timedelta(hours=MAX_GAP_H)
+    cn.execute("UPDATE storm_track SET active = ? WHERE last_time >= ?", (True, cut.strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def reset(cn):
+    # weather_data was emptied: drop every track.
+    cn.execute("DELETE FROM storm_track")
+    cn.execute("UPDATE weather_data SET track_id = NULL WHERE track_id IS NOT NULL")
+    db.set_meta(cn, "track_hwm", 0)
+
+
+def motion(cn, df):
+    # Per-row forecast step (deg lat, deg lon per hour) from each row's track
+    # velocity; rows without a moving track keep the per-event default.
+    typ = df["event_type"].to_numpy() if "event_type" in df else np.full(len(df), "")
+    move = np.array([forecast.motion.get(t, forecast.MOVE) for t in typ], dtype=np.float64).reshape(-1, 2)
+    if "track_id" not in df or not len(df):
+        return move
+    tid = df["track_id"].to_numpy(dtype=np.float64, na_value=np.nan)
+    tid[tid < 0] = np.nan  # the snapshot stores "no track" as -1
+    want = np.unique(tid[np.isfinite(tid)]).astype(np.int64).tolist()
+    vel = {}
+    for i in range(0, len(want), 900):
+        part = want[i : i + 900]
+        q = f"SELECT id, vlat, vlon FROM storm_track WHERE hits > 1 AND id IN ({', '.join('?' * len(part))})"
+        vel.update({r[0]: (r[1], r[2]) for r in cn.execute(q, part)})
+    for r in np.flatnonzero(np.isfinite(tid)):
+        v = vel.get(int(tid[r]))
+        if v is not None:
+            move[r] = v
+    return move
@@ -0,0 +1,262 @@
+import glob
+import math
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+import data
+import db
+import forecast
+from inference import FEATURES, MODEL_PATH, CyclonePredictor
+
+CKPT_DIR = os.path.join("models", "checkpoints")
+KEEP = 5  # versioned weight files kept next to MODEL_PATH
+GATE_KM = 300.0  # max distance to the same system in the next granule
+MAX_GAP_H = 3.0  # granule pairs further apart than this are not used
+VAL_EVERY = 10  # every 10th granule pair is held out for validation
+
+# Fixed input scaling used while training; fold() bakes it into fc1 so the
+# saved weights still take raw (lat, lon, bt, insolation, moisture).
+MEAN = np.array([22.0, 83.0, 250.0, 400.0, 40.0], dtype=np.float32)
+STD = np.array([8.0, 8.0, 30.0, 300.0, 20.0], dtype=np.float32)
+
+
+def granule_pairs(events=None, since=None, until=None, path=None):
+    cond, args = [], []
+    if events:
+        cond.append(f"event_type IN ({', '.join('?' * len(events))})")
+        args.extend(events)
+    if since:
+        cond.append("obs_time >= ?")
+        args.append(str(since))
+    if until:
+        cond.append("obs_time < ?")
+        args.append(str(until))
+    q = "SELECT DISTINCT obs_time FROM weather_data WHERE obs_time IS NOT NULL"
+    if cond:
+        q += " AND " + " AND ".join(cond)
+    with data.reader(path) as cn:
+        times = [r[0] for r in cn.execute(q + " ORDER BY obs_time", args)]
+
+    pairs = []
+    for a, b in zip(times, times[1:]):
+        h = (_ts(b) - _ts(a)) / 3600.0
+        if 0 < h <= MAX_GAP_H:
+            pairs.append((a, b, h))
+    return pairs
+
+
+def _ts(t):
+    return datetime.strptime(str(t)[:19], "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def samples(cn, t0, t1, hours, events=None):
+    # Each detection at t0 is matched to the nearest detection of the same
+    # event type at t1; the target is the per-hour intensity shift that
+    # forecast.propagate adds on top of its decay.
+    cols = ["lat", "lon", "intensity", "event_type"] + list(forecast.defaults)
+    q = f"SELECT {', '.join(cols)} FROM weather_data WHERE obs_time = ?"
+    a = data.frame(cn.execute(q, (t0,)), cols)
+    b = data.frame(cn.execute(q, (t1,)), cols)
+    if events:
+        a = a[a["event_type"].isin(events)]
+    xs, ys = [], []
+    for typ, grp in a.groupby("event_type"):
+        nxt = b[b["event_type"] == typ]
+        if nxt.empty:
+            continue
+        d = data.haversine(
+            grp["lat"].to_numpy()[:, None],
+            grp["lon"].to_numpy()[:, None],
+            nxt["lat"].to_numpy()[None],
+            nxt["lon"].to_numpy()[None],
+        )
+        j = d.argmin(axis=1)
+        ok = d[np.arange(len(grp)), j] <= GATE_KM
+        if not ok.any():
+            continue
+        cur = grp[ok]
+        rate = forecast.decay.get(typ, forecast.DECAY) ** hours
+        shift = (nxt["intensity"].to_numpy()[j[ok]] - cur["intensity"].to_numpy() * rate) / hours
+        x = np.column_stack(
+            [cur["lat"], cur["lon"]]
+            + [cur[c].fillna(v).to_numpy() for c, v in forecast.defaults.items()]
+        )
+        xs.append(x)
+        ys.append(shift)
+    if not xs:
+        return np.zeros((0, len(FEATURES)), np.float32), np.zeros(0, np.float32)
+    return np.concatenate(xs).astype(np.float32), np.concatenate(ys).astype(np.float32)
+
+
+class WeatherStream(IterableDataset):
+    # Streams samples granule pair by granule pair; each DataLoader worker
+    # takes every n-th pair and opens its own read connection.
+    def __init__(self, pairs, events=None, path=None, seed=0):
+        self.pairs = pairs
+        self.events = events
+        self.path = path
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        info = get_worker_info()
+        wid, nw = (info.id, info.num_workers) if info else (0, 1)
+        order = np.random.default_rng(self.seed + self.epoch).permutation(len(self.pairs))
+        cn = db.connect(self.path, readonly=True)
+        try:
+            for i in order[wid::nw]:
+                x, y = samples(cn, *self.pairs[i], self.events)
+                x = (x - MEAN) / STD
+                for k in np.random.default_rng(self.seed + self.epoch + int(i)).permutation(len(y)):
+                    yield torch.from_numpy(x[k]), torch.tensor(y[k])
+        finally:
+            cn.close()
+
+
+def fold(model):
+    # Rewrite fc1 so the model takes raw features: W(x - m)/s + b.
+    m, s = torch.from_numpy(MEAN), torch.from_numpy(STD)
+    with torch.no_grad():
+        w = model.fc1.weight / s
+        model.fc1.bias -= (w * m).sum(dim=1)
+        model.fc1.weight.copy_(w)
+    return model
+
+
+def save_atomic(obj, path):
+    tmp = path + ".part"
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def publish(model, path=MODEL_PATH):
+    # Versioned copy first, then an atomic swap of the live file; the
+    # registry reloads it on its next call because the mtime changed.
+    out = CyclonePredictor()
+    out.load_state_dict(model.state_dict())
+    fold(out)
+    root, ext = os.path.splitext(path)
+    ver = f"{root}_{datetime.now():%Y%m%d_%H%M%S}{ext}"
+    save_atomic(out.state_dict(), ver)
+    shutil.copyfile(ver, path + ".part")
+    os.replace(path + ".part", path)
+    for old in sorted(glob.glob(f"{root}_*{ext}"))[:-KEEP]:
+        os.remove(old)
+    return ver
+
+
+def evaluate(model, loader):
+    model.eval()
+    tot, n = 0.0, 0
+    with torch.inference_mode():
+        for x, y in loader:
+            tot += float(((model(x)[:, 0] - y) ** 2).sum())
+            n += len(y)
+    model.train()
+    return math.sqrt(tot / n) if n else None
+
+
+def train(
+    epochs=20,
+    batch_size=512,
+    lr=1e-3,
+    workers=None,
+    events=None,
+    since=None,
+    until=None,
+    resume=False,
+    max_minutes=None,
+    path=None,
+    out=MODEL_PATH,
+):
+    cpus = os.cpu_count() or 1
+    workers = min(4, cpus) if workers is None else workers
+    torch.set_num_threads(cpus)
+    torch.manual_seed(0)
+
+    pairs = granule_pairs(events, since, until, path)
+    if not pairs:
+        print("No consecutive granules to train on")
+        return None
+    val_pairs = pairs[::VAL_EVERY]
+    train_pairs = [p for i, p in enumerate(pairs) if i % VAL_EVERY]
+    print(f"{len(train_pairs)} training / {len(val_pairs)} validation granule pairs")
+
+    ds = WeatherStream(train_pairs, events, path)
+    kw = dict(batch_size=batch_size, num_workers=workers, persistent_workers=False)
+    loader = DataLoader(ds, **kw)
+    val = DataLoader(WeatherStream(val_pairs, events, path), **kw)
+
+    model = CyclonePredictor()
+    opt = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = nn.SmoothL1Loss()
+    start, best = 0, None
+
+    os.makedirs(CKPT_DIR, exist_ok=True)
+    ckpt = os.path.join(CKPT_DIR, "last.pt")
+    if resume and os.path.exists(ckpt):
+        st = torch.load(ckpt, weights_only=False)
+        model.load_state_dict(st["model"])
+        opt.load_state_dict(st["opt"])
+        start, best = st["epoch"] + 1, st["best"]
+        print(f"Resumed from epoch {st['epoch']} (best val RMSE {best})")
+
+    t0 = time.monotonic()
+    for epoch in range(start, epochs):
+        ds.epoch = epoch
+        tot, n = 0.0, 0
+        for x, y in loader:
+            opt.zero_grad()
+            loss = loss_fn(model(x)[:, 0], y)
+            loss.backward()
+            opt.step()
+            tot += loss.item() * len(y)
+            n += len(y)
+        if not n:
+            print("No training samples")
+            return None
+
+        rmse = evaluate(model, val)
+        print(f"epoch {epoch}: train loss {tot / n:.4f}, val RMSE {rmse}, {n} samples")
+        if rmse is not None and (best is None or rmse < best):
+            best = rmse
+            save_atomic(model.state_dict(), os.path.join(CKPT_DIR, "best.pt"))
+        save_atomic({"model": model.state_dict(), "opt": opt.state_dict(), "epoch": epoch, "best": best}, ckpt)
+
+        if max_minutes and time.monotonic() - t0 > max_minutes * 60:
+            print(f"Time budget of {max_minutes} min reached")
+            break
+
+    best_path = os.path.join(CKPT_DIR, "best.pt")
+    if os.path.exists(best_path):
+        model.load_state_dict(torch.load(best_path, weights_only=True))
+    ver = publish(model, out)
+    print(f"Saved {ver} -> {out}")
+    return ver
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Train CyclonePredictor on weather_data")
+    ap.add_argument("--epochs", type=int, default=20)
+    ap.add_argument("--batch-size", type=int, default=512)
+    ap.add_argument("--lr", type=float, default=1e-3)
+    ap.add_argument("--workers", type=int, help="DataLoader worker processes")
+    ap.add_argument("--events", nargs="*", help="event types to train on (default: all)")
+    ap.add_argument("--since", help="first obs_time, e.g. 2024-05-01")
+    ap.add_argument("--until", help="end obs_time (exclusive)")
+    ap.add_argument("--resume", action="store_true", help="continue from models/checkpoints/last.pt")
+    ap.add_argument("--max-minutes", type=float, help="stop after the epoch that crosses this")
+    ap.add_argument("--out", default=MODEL_PATH)
+    a = ap.parse_args()
+    train(
+        a.epochs, a.batch_size, a.lr, a.workers, a.events, a.since, a.until, a.resume, a.max_minutes, out=a.out
+    )
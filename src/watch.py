@@ -0,0 +1,215 @@
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import alerts
+import db
+import forecast
+import metrics
+import scanner
+import snapshot
+
+INTERVAL = 2.0  # seconds between directory polls
+SETTLE = 1.0  # a file must be untouched this long before it is read
+QUEUE = 256
+COMMIT_FILES = 32
+COMMIT_SECS = 2.0
+SNAPSHOT_SECS = 10.0  # columnar snapshot refresh, at most this often
+
+GONE = None  # queue marker for a file that disappeared
+
+
+def _ignore_sigint():
+    # Workers share the terminal's process group; only the parent handles ^C.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Watcher:
+    # Polls the data folder (woken early by inotify when available) and
+    # feeds new, changed and removed granules into a bounded queue. put()
+    # blocks while the queue is full, so a slow ingest pauses the poller.
+    def __init__(self, data_dir, known, q, stop, interval=INTERVAL):
+        self.data_dir = data_dir
+        self.seen = {f: tuple(v[:2]) for f, v in known.items()}
+        self.q = q
+        self.stop = stop
+        self.interval = interval
+        self.wake = threading.Event()
+
+    def poll(self):
+        now = time.time()
+        fls = scanner.list_files(self.data_dir)
+        for f in fls:
+            try:
+                st = os.stat(os.path.join(self.data_dir, f))
+            except FileNotFoundError:
+                continue
+            key = (st.st_size, st.st_mtime)
+            if self.seen.get(f) == key or now - st.st_mtime < SETTLE:
+                continue
+            if not self.put((f, key)):
+                return
+            self.seen[f] = key
+        for f in set(self.seen) - set(fls):
+            if not self.put((f, GONE)):
+                return
+            del self.seen[f]
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.q.put(item, timeout=0.5)
+                metrics.gauge("watch_queue_depth", self.q.qsize())
+                return True
+            except queue.Full:
+                metrics.inc("watch_queue_full")
+        return False
+
+    def notify(self):
+        # Optional inotify wake-up; polling stays the source of truth.
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            return
+        ino = INotify()
+        ino.add_watch(self.data_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM)
+        while not self.stop.is_set():
+            if ino.read(timeout=500):
+                self.wake.set()
+
+    def loop(self):
+        while not self.stop.is_set():
+            try:
+                self.poll()
+            except OSError as e:
+                print(f"Poll failed: {e}")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def start(self):
+        for fn in (self.loop, self.notify):
+            threading.Thread(target=fn, daemon=True).start()
+
+
+def flush(cn, ready, gone, log, since=None):
+    # `since` is when this batch's first file was submitted, so scan_run_seconds
+    # adds up to the time spent ingesting, as it does for scanner.run().
+    if not ready and not gone:
+        return False
+    t = time.perf_counter()
+    fls = scanner.list_files()
+    pos = {f: i for i, f in enumerate(fls)}
+    files, n = scanner.commit(cn, ready, log, pos, max(len(fls), 1), gone)
+    for f, res in ready.items():
+        log[f] = (res["size"], res["mtime"], res["hash"])
+    for f in gone:
+        log.pop(f, None)
+    metrics.observe("watch_commit_seconds", time.perf_counter() - t)
+    metrics.inc("watch_files_committed", len(ready))
+    print(f"Committed {files} files, {n} rows ({len(gone)} removed), {alerts.evaluate(cn)} new alerts")
+    forecast.refresh(cn, forecast.default_ai())
+    metrics.observe("scan_run_seconds", time.perf_counter() - (since or t))
+    metrics.gauge("last_scan_timestamp", round(time.time(), 3))
+    metrics.write("watch")
+    changed = bool(files or gone)
+    ready.clear()
+    gone.clear()
+    return changed
+
+
+def refresh(cn):
+    try:
+        if snapshot.stale(cn):
+            snapshot.write(cn)
+    except (OSError, *db.ERRORS) as e:
+        print(f"Snapshot failed: {e}")
+
+
+def serve(workers=scanner.WORKERS, interval=INTERVAL, queue_size=QUEUE):
+    if not os.path.exists(scanner.DATA_DIR):
+        print(f"ERROR: Data folder not found at {scanner.DATA_DIR}")
+        return
+
+    cn = db.connect()
+    db.init_db(cn)
+    # The manifest is committed with the rows, so it is also the checkpoint:
+    # anything it does not match is picked up again after a restart.
+    log = scanner.manifest(cn)
+    print(f"Watching {scanner.DATA_DIR} ({len(log)} files already ingested)")
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    q = queue.Queue(maxsize=queue_size)
+    Watcher(scanner.DATA_DIR, log, q, stop, interval).start()
+
+    ready, gone, jobs = {}, [], {}
+    busy = None
+    last = snap = time.monotonic()
+    dirty = False
+    with ProcessPoolExecutor(max_workers=workers, initializer=_ignore_sigint) as ex:
+        while not stop.is_set() or jobs:
+            # At most 2 files per worker in flight; the rest wait in the queue.
+            while not stop.is_set() and len(jobs) < 2 * workers:
+                try:
+                    f, key = q.get(timeout=0.2 if not jobs else 0)
+                except queue.Empty:
+                    break
+                if key is GONE:
+                    gone.append(f)
+                    ready.pop(f, None)
+                else:
+                    busy = busy or time.perf_counter()
+                    jobs[ex.submit(scanner.scan_file, os.path.join(scanner.DATA_DIR, f))] = f
+
+            if jobs:
+                done, _ = wait(jobs, timeout=0.2, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    f = jobs.pop(fut)
+                    try:
+                        res = fut.result()
+                    except Exception as e:
+                        print(f"{f}: {e}")
+                        continue
+                    if not os.path.exists(os.path.join(scanner.DATA_DIR, f)):
+                        continue
+                    metrics.observe("scan_file_seconds", res["secs"])
+                    metrics.inc("files_scanned")
+                    metrics.inc("bytes_scanned", res["size"])
+                    metrics.inc("regions_found", len(res["regions"]))
+                    ready[f] = res
+
+            due = time.monotonic() - last >= COMMIT_SECS or not jobs
+            if len(ready) + len(gone) >= COMMIT_FILES or (due and (ready or gone)):
+                try:
+                    dirty |= flush(cn, ready, gone, log, busy)
+                    busy = time.perf_counter() if jobs else None
+                except db.ERRORS as e:
+                    # Left in ready/gone and retried on the next pass.
+                    print(f"Commit failed: {e}")
+                last = time.monotonic()
+
+            # Until the snapshot catches up, readers fall back to SQL.
+            if dirty and time.monotonic() - snap >= SNAPSHOT_SECS:
+                refresh(cn)
+                snap, dirty = time.monotonic(), False
+
+    if flush(cn, ready, gone, log, busy) or dirty:
+        refresh(cn)
+    cn.close()
+    print("Watcher stopped")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Ingest granules as they land in the data folder")
+    ap.add_argument("--workers", type=int, default=scanner.WORKERS)
+    ap.add_argument("--interval", type=float, default=INTERVAL, help="poll interval in seconds")
+    ap.add_argument("--queue", type=int, default=QUEUE, help="max files waiting to be read")
+    a = ap.parse_args()
+    serve(a.workers, a.interval, a.queue)